@@ -1,27 +1,64 @@
 #!/usr/bin/env python3
 
 from os.path import join, exists, isfile, islink, getsize, abspath
-from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from os import access, R_OK
-from hashlib import md5
+from argparse import ArgumentParser
+from functools import partial
+from mmap import mmap, ACCESS_READ
+from contextlib import ExitStack
+from threading import Condition
 from json import dumps
 from os import walk
 
 
+# Size in bytes of the chunks read at the same time from every file of
+# a group.
+CHUNK_SIZE = 64 * 1024
+
+# Maximum number of files kept open at the same time while comparing
+# a group of files.
+MAX_OPEN_FILES = 256
+
+# Minimum size in bytes of the files mapped in memory to be compared,
+# instead of being read chunk by chunk.
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+# Default maximum number of bytes of the chunks read at the same time by
+# all the groups compared in parallel.
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Size in bytes under which the chunks of a group are only made smaller
+# once the group can't have chunks of this size with the whole budget.
+MIN_CHUNK_SIZE = 4 * 1024
+
+
 # ---------------------Get Argument From User----------------------
 def get_argument():
     """
-    Return an absolute path which is inputted
-    by the user through the command line.
+    Return the arguments inputted by the user through the command line:
+    an absolute path of a directory, the number of jobs and the memory
+    budget.
 
-    @return: an absolute path of a directory.
+    @return: an argparse Namespace of the arguments.
     """
     parser = ArgumentParser(prog="Duplicate Files Finder")
     parser.add_argument('-p', '--path', type=str,
                         required=True, metavar="path")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar="N",
+                        help="number of groups of files compared at the "
+                             "same time")
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET,
+                        metavar="bytes",
+                        help="maximum size of the chunks read at the same "
+                             "time by all the groups compared")
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.memory_budget < 1:
+        parser.error("--memory-budget must be at least 1")
 
-    return args.path
+    return args
 
 
 # ---------------------Get Files From Valid Path-------------------
@@ -120,66 +157,360 @@ def file_comparison(file1, file2):
     @return: A Boolean value or None if no permission.
     """
     if access(file1, R_OK) and access(file2, R_OK):
-        data1 = open(file1, 'rb').read()
-        data2 = open(file2, 'rb').read()
-        return data1 == data2
+        if getsize(file1) != getsize(file2):
+            return False
+        return len(group_files_by_diff([file1, file2])) == 1
     else:
         return None
 
 
-def create_diff_group(file1, file_path_names):
+def compare_views(view1, view2):
+    """
+    Return True if 2 memoryviews of bytes have the same content, comparing
+    them 8 bytes at a time without copying them.
+
+    @param view1, view2: The 2 memoryviews.
+
+    @return: A Boolean value.
+    """
+    if len(view1) != len(view2):
+        return False
+    aligned = len(view1) - len(view1) % 8
+
+    return view1[:aligned].cast('Q') == view2[:aligned].cast('Q') and \
+        view1[aligned:].tobytes() == view2[aligned:].tobytes()
+
+
+def split_by_view(mapped, offset, chunk_size=CHUNK_SIZE):
+    """
+    Return the groups of mapped files which have the same chunk.
+
+    @param mapped: The list of tuples of a file and the memoryview of its
+    mapping, for the files of a group.
+
+    @param offset: The position of the chunk in the files.
+
+    @param chunk_size: The size in bytes of the chunk.
+
+    @return: A list of tuples of a Boolean value, True if the chunk is
+    after the end of the files, and the mapped files which have the same
+    chunk.
+    """
+    view_list = []
+    for file, view in mapped:
+        chunk = view[offset:offset + chunk_size]
+        for first_chunk, same_files in view_list:
+            if compare_views(first_chunk, chunk):
+                same_files.append((file, view))
+                break
+        else:
+            view_list.append((chunk, [(file, view)]))
+
+    return [(not chunk, same_files) for chunk, same_files in view_list]
+
+
+def split_by_chunk(files, chunks):
+    """
+    Return the groups of files which have read the same chunk.
+
+    @param files: The list of files, or of opened files, of a group.
+
+    @param chunks: The chunk read from each file, in the same order.
+
+    @return: A list of tuples of the chunk and the files which have read
+    that chunk.
+    """
+    chunk_dict = {}
+    for file, chunk in zip(files, chunks):
+        if chunk in chunk_dict:
+            chunk_dict[chunk].append(file)
+        else:
+            chunk_dict[chunk] = [file]
+
+    return list(chunk_dict.items())
+
+
+def read_chunk(file, offset, chunk_size=CHUNK_SIZE):
+    """
+    Return a chunk of a file without keeping the file open.
+
+    @param file: The path of the file.
+
+    @param offset: The position of the chunk in the file.
+
+    @param chunk_size: The size in bytes of the chunk.
+
+    @return: The content of the chunk.
+    """
+    with open(file, 'rb') as data:
+        data.seek(offset)
+        return data.read(chunk_size)
+
+
+def compare_open_files(file_path_names, offset=0, chunk_size=CHUNK_SIZE):
+    """
+    Return a list of groups of files with the same content, reading all
+    the files at the same time chunk by chunk and splitting the group as
+    soon as the chunks differ, so each byte is read only once.
+
+    @param file_path_names: The list of files with the same size.
+
+    @param offset: The position from which the files are compared.
+
+    @param chunk_size: The size in bytes of the chunks read from the files.
+
+    @return: A list of groups of files.
+    """
+    diff_groups = []
+    with ExitStack() as stack:
+        opened = []
+        for file in file_path_names:
+            data = stack.enter_context(open(file, 'rb'))
+            data.seek(offset)
+            opened.append((file, data))
+        pending = [opened]
+        while pending:
+            group = pending.pop()
+            # A file alone can't have a duplicate anymore
+            if len(group) == 1:
+                diff_groups.append([group[0][0]])
+                continue
+            chunks = [data.read(chunk_size) for _, data in group]
+            for chunk, files in split_by_chunk(group, chunks):
+                # Every file of the group has been read until the end
+                if not chunk:
+                    diff_groups.append([file for file, _ in files])
+                else:
+                    pending.append(files)
+
+    return diff_groups
+
+
+def compare_mapped_files(file_path_names, offset=0, chunk_size=CHUNK_SIZE):
     """
-    Return a list of duplicate files based on content of the files.
+    Return a list of groups of files with the same content, mapping all
+    the files in memory and comparing their mappings chunk by chunk, so
+    the content is never copied.
 
-    @param file1: The source file to be compared.
+    @param file_path_names: The list of files with the same size.
 
-    @param file_path_names: The list that has files to be compared to
-    the source file.
+    @param offset: The position from which the files are compared.
 
-    @return: A list of duplicate files.
+    @param chunk_size: The size in bytes of the chunks compared.
+
+    @return: A list of groups of files.
     """
-    group = [file1]
-    for file2 in file_path_names:
-        if file2 != file1 and file_comparison(file1, file2):
-            group.append(file2)
+    diff_groups = []
+    with ExitStack() as stack:
+        mapped = []
+        for file in file_path_names:
+            data = stack.enter_context(open(file, 'rb'))
+            mapping = stack.enter_context(
+                mmap(data.fileno(), 0, access=ACCESS_READ))
+            mapped.append((file, stack.enter_context(memoryview(mapping))))
+        pending = [(mapped, offset)]
+        while pending:
+            group, offset = pending.pop()
+            # A file alone can't have a duplicate anymore
+            if len(group) == 1:
+                diff_groups.append([group[0][0]])
+                continue
+            for ended, files in split_by_view(group, offset, chunk_size):
+                # Every file of the group has been compared until the end
+                if ended:
+                    diff_groups.append([file for file, _ in files])
+                else:
+                    pending.append((files, offset + chunk_size))
 
-    return sorted(group)
+    return diff_groups
 
 
-def group_files_by_diff(file_path_names):
+def group_files_by_diff(file_path_names, chunk_size=CHUNK_SIZE,
+                        max_open_files=MAX_OPEN_FILES):
     """
     Return a list of groups of duplicate files based on content of the files.
 
+    The files are compared all together chunk by chunk.  When a group has
+    more files than the maximum number of open files, its files are opened
+    for each chunk until the group is split into groups small enough.
+    The files bigger than MMAP_THRESHOLD are mapped in memory and compared
+    without being copied.
+
     @param file_path_names: The list that has files to be compared.
+    All the files must have the same size.
+
+    @param chunk_size: The size in bytes of the chunks read from the files.
+
+    @param max_open_files: The maximum number of files opened at the same
+    time.
 
     @return: A list of groups of duplicate files.
     """
     diff_groups = []
-    # Get the list of files with same content
-    for file1 in file_path_names:
-        group = create_diff_group(file1, file_path_names)
-        if group not in diff_groups:
-            diff_groups.append(group)
+    # The files which can't be read are alone in their group
+    readable = []
+    for file in file_path_names:
+        if access(file, R_OK):
+            readable.append(file)
+        else:
+            diff_groups.append([file])
+    pending = [(readable, 0)] if readable else []
+    while pending:
+        group, offset = pending.pop()
+        if len(group) <= max_open_files:
+            if getsize(group[0]) >= MMAP_THRESHOLD:
+                diff_groups += compare_mapped_files(group, offset,
+                                                    chunk_size)
+            else:
+                diff_groups += compare_open_files(group, offset, chunk_size)
+            continue
+        chunks = [read_chunk(file, offset, chunk_size) for file in group]
+        for chunk, files in split_by_chunk(group, chunks):
+            if not chunk:
+                diff_groups.append(files)
+            else:
+                pending.append((files, offset + chunk_size))
+    # Keep the groups in the order of their first file
+    positions = {file: index for index, file in enumerate(file_path_names)}
+    diff_groups = [sorted(group) for group in diff_groups]
+    diff_groups.sort(key=lambda group: min(map(positions.get, group)))
 
     return diff_groups
 
 
+class MemoryBudget:
+    """
+    Number of bytes of the chunks that the groups compared at the same
+    time can read, shared like a semaphore counting bytes instead of
+    workers.
+    """
+
+    def __init__(self, size):
+        """
+        Create a budget with all its bytes available.
+
+        @param size: The number of bytes of the budget.
+        """
+        self.available = size
+        self.condition = Condition()
+
+    def acquire(self, size):
+        """
+        Wait until some bytes are available and take them.
+
+        @param size: The number of bytes taken, at most the size of the
+        budget.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.available >= size)
+            self.available -= size
+
+    def release(self, size):
+        """
+        Give back some bytes taken by acquire.
+
+        @param size: The number of bytes given back.
+        """
+        with self.condition:
+            self.available += size
+            self.condition.notify_all()
+
+
+def get_chunk_size(file_count, jobs=1, memory_budget=MEMORY_BUDGET):
+    """
+    Return the size of the chunks read from the files of a group, so the
+    chunk of every file of the group fits in the memory budget.
+
+    The chunks are the largest fitting in the share of the budget of each
+    of the groups compared at the same time, up to CHUNK_SIZE.  When the
+    share is too small for chunks of MIN_CHUNK_SIZE, the group takes more
+    of the budget and waits for the other groups, and the chunks are only
+    made smaller than MIN_CHUNK_SIZE if the whole budget is too small.
+
+    @param file_count: The number of files of the group.
+
+    @param jobs: The number of groups compared at the same time.
+
+    @param memory_budget: The maximum number of bytes of the chunks read
+    at the same time by all the groups.
+
+    @return: The size in bytes of the chunks, at most CHUNK_SIZE.
+
+    @raise ValueError: if the budget can't hold a byte of each file.
+    """
+    file_count = max(file_count, 1)
+    chunk_size = min(CHUNK_SIZE, memory_budget // (max(jobs, 1) * file_count))
+    if chunk_size < MIN_CHUNK_SIZE:
+        chunk_size = min(MIN_CHUNK_SIZE, memory_budget // file_count)
+    if chunk_size < 1:
+        raise ValueError("a memory budget of %d bytes can't compare %d files"
+                         % (memory_budget, file_count))
+
+    return chunk_size
+
+
+def compare_group(file_path_names, jobs=1, memory_budget=MEMORY_BUDGET,
+                  budget=None):
+    """
+    Return the groups of duplicate files of a group of files with the same
+    size, with chunks small enough for its share of the memory budget.
+
+    @param file_path_names: The list of files with the same size.
+
+    @param jobs: The number of groups compared at the same time.
+
+    @param memory_budget: The maximum number of bytes of the chunks read
+    at the same time by all the groups.
+
+    @param budget: The MemoryBudget shared by the groups compared at the
+    same time, None if the group is compared alone.
+
+    @return: A list of groups of duplicate files.
+    """
+    chunk_size = get_chunk_size(len(file_path_names), jobs, memory_budget)
+    if budget is None:
+        return group_files_by_diff(file_path_names, chunk_size)
+    # The chunks of every file of the group are read at the same time
+    size = chunk_size * len(file_path_names)
+    budget.acquire(size)
+    try:
+        return group_files_by_diff(file_path_names, chunk_size)
+    finally:
+        budget.release(size)
+
+
 # --------Find Duplicate Files Based on Size and Diff----------
-def find_duplicate_files(file_path_names):
+def find_duplicate_files(file_path_names, jobs=1,
+                         memory_budget=MEMORY_BUDGET):
     """
     Return a list of groups of duplicates filtered by size and diff.
 
     @param file_path_names: A list of files with absolute paths.
 
+    @param jobs: The number of groups of files compared at the same time.
+
+    @param memory_budget: The maximum number of bytes of the chunks read
+    at the same time by all the groups compared.
+
     @return: A list of groups of duplicates.
     """
     groups = []
     # Grouping files by size first
     size_list = group_files_by_size(file_path_names)
-    # Grouping each group by difference in content
-    for group in size_list:
-        diff_groups = group_files_by_diff(group)
-        groups += diff_groups
+    # Grouping each group by difference in content, several groups at
+    # the same time while the files are read
+    if jobs > 1:
+        compare = partial(compare_group, jobs=jobs,
+                          memory_budget=memory_budget,
+                          budget=MemoryBudget(memory_budget))
+        with ThreadPoolExecutor(jobs) as executor:
+            for diff_groups in executor.map(compare, size_list):
+                groups += diff_groups
+    else:
+        compare = partial(compare_group, memory_budget=memory_budget)
+        for group in size_list:
+            diff_groups = compare(group)
+            groups += diff_groups
 
     return groups
 
@@ -191,7 +522,8 @@ def main():
     Convert the result into JSON formatted string.
     """
     try:
-        path = get_argument()
+        args = get_argument()
+        path = args.path
         # Error handling when the path don't exists or is a file
         if not exists(path) or isfile(path):
             print("Invalid path")
@@ -200,9 +532,14 @@ def main():
             # Get the list of files inside the directory specified by the path
             file_path_names = scan_files(path)
             # Return a list of groups of duplicate files
-            data = find_duplicate_files(file_path_names)
+            data = find_duplicate_files(file_path_names, args.jobs,
+                                        args.memory_budget)
             # Print out to JSON formatted string
             print(dumps(data))
+    # The memory budget is too small for a group of files
+    except ValueError as error:
+        print(error)
+        exit(1)
     except Exception:
         print("Check the directory or the input again!")
         exit(1)
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+from find_duplicate_files import scan_file_records, iter_duplicate_records
+from importlib.util import spec_from_file_location, module_from_spec
+from find_duplicate_files import ScanStats, print_groups
+from generate_duplicate_files import generate_files
+from os.path import join, dirname, abspath, getsize
+from contextlib import redirect_stdout
+from argparse import ArgumentParser
+from platform import python_version
+from subprocess import run, PIPE
+from time import perf_counter
+from tempfile import mkdtemp
+from json import dumps, load
+from os import walk, link
+from shutil import rmtree
+from io import StringIO
+from sys import stderr
+import random
+
+
+ONE_MB = 1024 * 1024
+
+# Corpora generated to time the finders, by name.  'files' are the
+# arguments of generate_files, 'near_duplicates' is the number of copies
+# of generated files which only differ by their last byte, and 'links'
+# the number of hard links added to each generated file.
+PROFILES = {
+    # Many tiny files, where scanning and grouping dominate
+    'tiny': {'files': {'file_count': 2000, 'file_min_size': 1,
+                       'file_max_size': 512, 'duplicate_file_ratio': 0.3,
+                       'directory_max_depth': 3}},
+    # A few huge files, where reading and hashing dominate
+    'huge': {'files': {'file_count': 6, 'file_min_size': 8 * ONE_MB,
+                       'file_max_size': 16 * ONE_MB,
+                       'duplicate_file_ratio': 0.5,
+                       'directory_max_depth': 1}},
+    # Files of the same size whose content only differs at the end, so
+    # none can be discarded before being read entirely
+    'same-size': {'files': {'file_count': 200, 'file_min_size': 64 * 1024,
+                            'file_max_size': 64 * 1024,
+                            'duplicate_file_ratio': 0.1,
+                            'directory_max_depth': 2},
+                  'near_duplicates': 200},
+    # Files linked several times, where each inode is read only once
+    'hardlinks': {'files': {'file_count': 500, 'file_min_size': 1024,
+                            'file_max_size': 8 * 1024,
+                            'duplicate_file_ratio': 0.2,
+                            'directory_max_depth': 2},
+                  'links': 3},
+}
+
+# Default seed of the random generator of the corpora.
+SEED = 0
+
+# Default number of times each finder is run on a corpus, keeping the
+# fastest time of each stage.
+ROUNDS = 3
+
+# Path of the finder comparing the files byte to byte.
+BONUS_PATH = join(dirname(abspath(__file__)), 'BONUS',
+                  'find_duplicate_files.py')
+
+
+# ---------------------Get Argument From User----------------------
+def get_argument():
+    """
+    Return the arguments inputted by the user through the command line.
+
+    @return: an argparse Namespace of the arguments.
+    """
+    parser = ArgumentParser(prog="Duplicate Files Finder Benchmark")
+    parser.add_argument('--profile', action='append',
+                        choices=sorted(PROFILES),
+                        help="corpus to time the finders on, all of them "
+                             "if not given")
+    parser.add_argument('--seed', type=int, default=SEED, metavar="N",
+                        help="seed of the random generator of the corpora")
+    parser.add_argument('--rounds', type=int, default=ROUNDS, metavar="N",
+                        help="number of runs of each finder, keeping the "
+                             "fastest time of each stage")
+    parser.add_argument('--scale', type=float, default=1.0, metavar="ratio",
+                        help="ratio applied to the number of files of the "
+                             "corpora")
+    parser.add_argument('-p', '--path', type=str, metavar="path",
+                        help="directory where the corpora are generated and "
+                             "kept, a temporary one if not given")
+    parser.add_argument('-o', '--output', type=str, metavar="path",
+                        help="file where the results are written in JSON, "
+                             "the standard output if not given")
+    parser.add_argument('--baseline', type=str, metavar="path",
+                        help="results of a previous run to compare the "
+                             "times of each stage with")
+    args = parser.parse_args()
+
+    return args
+
+
+# ---------------------Generating the Corpora----------------------
+def generate_corpus(path, profile, seed=SEED, scale=1.0):
+    """
+    Generate the files of a profile, the same ones for the same seed.
+
+    @param path: The directory where the files are generated.
+
+    @param profile: A profile of PROFILES.
+
+    @param seed: The seed of the random generator.
+
+    @param scale: The ratio applied to the number of files.
+
+    @return: A tuple of the number of files and their total size in bytes.
+    """
+    options = dict(profile['files'])
+    options['file_count'] = max(1, int(options['file_count'] * scale))
+    files = generate_files(root_path=path, seed=seed, **options)
+    # generate_files can pick the same path twice, keep the distinct ones
+    file_path_names = sorted({file for file, _ in files})
+    near_duplicates = int(profile.get('near_duplicates', 0) * scale)
+    for index in range(near_duplicates):
+        source = random.choice(file_path_names)
+        with open(source, 'rb') as data:
+            content = bytearray(data.read())
+        if content:
+            content[-1] ^= 1 + index % 255
+        with open('%s.near%d' % (source, index), 'wb') as data:
+            data.write(content)
+    for index in range(profile.get('links', 0)):
+        for file in file_path_names:
+            link(file, '%s.link%d' % (file, index))
+    file_count = 0
+    total_size = 0
+    for root, _, file_list in walk(path):
+        for file_name in file_list:
+            file_count += 1
+            total_size += getsize(join(root, file_name))
+
+    return file_count, total_size
+
+
+# ---------------------Timing the Stages---------------------------
+def time_stages(stages, rounds=ROUNDS):
+    """
+    Run a list of stages several times and return the fastest time of
+    each stage.
+
+    @param stages: A function returning a generator which yields the name
+    of each stage once it is done.
+
+    @param rounds: The number of runs of the stages.
+
+    @return: A tuple of a dictionary of the names of the stages and their
+    fastest time in seconds, and the value returned by the last run.
+    """
+    timings = {}
+    for _ in range(rounds):
+        run_stages = stages()
+        start = perf_counter()
+        try:
+            while True:
+                name = next(run_stages)
+                end = perf_counter()
+                timings[name] = min(timings.get(name, end - start),
+                                    end - start)
+                start = perf_counter()
+        except StopIteration as stop:
+            result = stop.value
+
+    return timings, result
+
+
+def main_finder_stages(path):
+    """
+    Find the duplicates of a directory with the checksum finder, one
+    stage after another, through the same functions as its command line.
+
+    @param path: The directory of the corpus.
+
+    @return: A generator yielding the name of each stage once it is done,
+    and returning a dictionary of the number of groups of duplicates and
+    the wall time of each stage of the search counted by ScanStats.
+    """
+    records = list(scan_file_records(path))
+    yield 'scan'
+    stats = ScanStats()
+    groups = list(iter_duplicate_records(records, stats=stats))
+    yield 'search'
+    with redirect_stdout(StringIO()):
+        print_groups(groups)
+    yield 'output'
+
+    return {'groups': len(groups),
+            'search_stages': {stage: counters['wall_time'] for
+                              stage, counters in stats.report().items()}}
+
+
+def load_bonus_finder():
+    """
+    Return the module of the finder comparing the files byte to byte,
+    which has the same name as the checksum finder.
+
+    @return: The module of the BONUS finder.
+    """
+    spec = spec_from_file_location('bonus_find_duplicate_files', BONUS_PATH)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def bonus_finder_stages(path, bonus=None):
+    """
+    Find the duplicates of a directory with the byte to byte finder, one
+    stage after another.
+
+    @param path: The directory of the corpus.
+
+    @param bonus: The module of the BONUS finder, loaded if not given.
+
+    @return: A generator yielding the name of each stage once it is done,
+    and returning a dictionary of the number of groups of duplicates.
+    """
+    bonus = bonus or load_bonus_finder()
+    file_path_names = bonus.scan_files(path)
+    yield 'scan'
+    size_list = bonus.group_files_by_size(file_path_names)
+    yield 'size'
+    groups = []
+    for group in size_list:
+        groups += bonus.group_files_by_diff(group)
+    yield 'compare'
+    dumps(groups)
+    yield 'output'
+
+    # The BONUS finder keeps the files without duplicate as groups
+    return {'groups': sum(len(group) > 1 for group in groups)}
+
+
+def run_benchmark(path, profiles=None, seed=SEED, rounds=ROUNDS,
+                  scale=1.0):
+    """
+    Generate the corpora of some profiles and time both finders on them.
+
+    @param path: The directory where the corpora are generated.
+
+    @param profiles: The names of the profiles, all of them if None.
+
+    @param seed: The seed of the random generator of the corpora.
+
+    @param rounds: The number of runs of each finder on a corpus.
+
+    @param scale: The ratio applied to the number of files.
+
+    @return: A list of dictionaries of the results of a finder on a
+    corpus.
+    """
+    bonus = load_bonus_finder()
+    finders = {'main': main_finder_stages,
+               'bonus': lambda path: bonus_finder_stages(path, bonus)}
+    results = []
+    for name in profiles or sorted(PROFILES):
+        corpus = join(path, name)
+        rmtree(corpus, ignore_errors=True)
+        file_count, total_size = generate_corpus(corpus, PROFILES[name],
+                                                 seed, scale)
+        for finder, stages in finders.items():
+            timings, details = time_stages(lambda: stages(corpus), rounds)
+            result = {'profile': name, 'finder': finder,
+                      'files': file_count, 'bytes': total_size,
+                      'stages': timings, 'total': sum(timings.values())}
+            result.update(details)
+            results.append(result)
+
+    return results
+
+
+def get_commit():
+    """
+    Return the commit of the finders being timed.
+
+    @return: The hash of the commit, or None outside of a git repository.
+    """
+    try:
+        process = run(['git', 'rev-parse', 'HEAD'], stdout=PIPE,
+                      stderr=PIPE, cwd=dirname(abspath(__file__)))
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+
+    return process.stdout.decode().strip()
+
+
+# ---------------------Comparing the Results-----------------------
+def compare_results(baseline, results):
+    """
+    Return the times of the stages of a run next to the ones of a previous
+    run, for the same finder on the same corpus.
+
+    @param baseline: The list of results of the previous run.
+
+    @param results: The list of results of the current run.
+
+    @return: A list of tuples of the profile, the finder, the stage, the
+    previous time, the current time and their ratio.
+    """
+    previous = {(result['profile'], result['finder']): result
+                for result in baseline}
+    comparison = []
+    for result in results:
+        old = previous.get((result['profile'], result['finder']))
+        if old is None:
+            continue
+        for stage, seconds in result['stages'].items():
+            if stage in old['stages']:
+                old_seconds = old['stages'][stage]
+                ratio = seconds / old_seconds if old_seconds else None
+                comparison.append((result['profile'], result['finder'],
+                                   stage, old_seconds, seconds, ratio))
+
+    return comparison
+
+
+# ---------------------------Main Function-------------------------
+def main():
+    """
+    Entry point of the script.
+    Write the results into a JSON formatted string.
+    """
+    args = get_argument()
+    path = args.path or mkdtemp(prefix='duplicates-benchmark-')
+    try:
+        results = run_benchmark(path, args.profile, args.seed, args.rounds,
+                                args.scale)
+    finally:
+        if args.path is None:
+            rmtree(path)
+    data = {'commit': get_commit(), 'python': python_version(),
+            'seed': args.seed, 'rounds': args.rounds, 'scale': args.scale,
+            'results': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(dumps(data, indent=2))
+    else:
+        print(dumps(data, indent=2))
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            comparison = compare_results(load(baseline)['results'],
+                                         results)
+        for profile, finder, stage, old, new, ratio in comparison:
+            print('%-10s %-6s %-8s %10.6f %10.6f %s' % (
+                profile, finder, stage, old, new,
+                '%.2fx' % ratio if ratio is not None else '-'), file=stderr)
+
+
+if __name__ == "__main__":
+    main()
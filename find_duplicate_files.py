@@ -1,27 +1,483 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from asyncio import Queue, get_running_loop, run_coroutine_threadsafe
+from concurrent.futures import wait, FIRST_COMPLETED
 from os.path import join, exists, isfile, islink, getsize, abspath
-from argparse import ArgumentParser
-from os import access, R_OK
-from hashlib import md5
-from json import dumps
-from os import walk
+from os.path import splitext
+from os import access, fstat, scandir, stat, sep, R_OK, SEEK_END
+from os import open as open_fd, close, fsdecode, makedev, O_RDONLY
+from ctypes import CDLL, create_string_buffer, string_at
+from ctypes import c_char_p, c_int, c_uint, c_size_t, c_void_p
+from stat import S_ISDIR, S_ISLNK
+from ctypes.util import find_library
+from struct import Struct
+from mmap import mmap, ACCESS_READ
+from collections import namedtuple
+from argparse import ArgumentParser, ArgumentTypeError
+from functools import partial, lru_cache
+from itertools import repeat
+from hashlib import md5, sha1, sha256, blake2b
+from time import time, perf_counter, process_time
+from cProfile import Profile
+from json import dumps, loads
+from threading import Event, Lock, local
+from sqlite3 import connect
+from array import array
+from fnmatch import translate
+from sys import stderr
+import tracemalloc
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from xxhash import xxh3_128
+except ImportError:
+    xxh3_128 = None
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+
+# Default size in bytes of the buffer used to stream a file's content
+# into the hash function.
+BUFFER_SIZE = 64 * 1024
+
+# Default minimum size in bytes of the files mapped in memory to be hashed
+# or compared, instead of being read into a buffer.
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+# Number of files sent at once to a process hashing files.
+CHUNK_SIZE = 16
+
+# Default size in bytes of the block hashed at the beginning of the files
+# of a same size group, before reading them entirely.
+HEAD_SIZE = 4 * 1024
+
+# Default size in bytes of the block hashed at the end of the files
+# whose head blocks are identical.
+TAIL_SIZE = 4 * 1024
+
+# Default maximum number of hashes kept in the persistent cache.
+CACHE_MAX_ENTRIES = 10 ** 7
+
+# Number of hashes used from the persistent cache marked at once, so the
+# hashes used are not all kept in memory until the cache is closed.
+CACHE_USED_BATCH = 10000
+
+# Minimum number of files hashed together before their groups of
+# duplicates are printed in streaming mode.
+BATCH_SIZE = 10000
+
+# Hash functions that can be used to compare the content of the files,
+# by name.  The non-cryptographic ones are only available when their
+# package is installed.
+HASH_ALGORITHMS = {'md5': md5, 'sha1': sha1, 'sha256': sha256,
+                   'blake2b': blake2b}
+if xxh3_128 is not None:
+    HASH_ALGORITHMS['xxh3'] = xxh3_128
+if blake3 is not None:
+    HASH_ALGORITHMS['blake3'] = blake3
+
+# Default hash function used to compare the content of the files.
+HASH_ALGORITHM = 'md5'
+
+# Size in bytes of the data hashed by each hash function to find the
+# fastest one on this host.
+BENCHMARK_SIZE = 4 * 1024 * 1024
+
+# Default minimum number of seconds between two saves of the progress
+# of a run which can be resumed.
+CHECKPOINT_INTERVAL = 10
+
+# Maximum number of groups of duplicates found by an asynchronous scan
+# and waiting to be consumed, before the scan is paused.
+QUEUE_SIZE = 64
+
+# Functions reading the entries of a directory, by name.  'statx' reads
+# the entries with getdents64 and stats the files with statx through
+# ctypes, it is Linux only and falls back to 'scandir' elsewhere.
+SCANNERS = ('scandir', 'statx')
+
+# Size in bytes of the buffer filled with the entries of a directory by
+# each getdents64 call, so large directories are read in a few calls.
+GETDENTS_BUFFER_SIZE = 256 * 1024
+
+# Types of the entries returned by getdents64.
+DT_UNKNOWN = 0
+DT_DIR = 4
+DT_LNK = 10
+
+# Fields of the status returned by statx, only the ones in FileRecord
+# and the type of the entry are requested from the file system.
+STATX_TYPE = 0x0001
+STATX_MODE = 0x0002
+STATX_MTIME = 0x0040
+STATX_INO = 0x0100
+STATX_SIZE = 0x0200
+STATX_MASK = STATX_TYPE | STATX_MODE | STATX_MTIME | STATX_INO | STATX_SIZE
+
+# Flags of statx: don't follow the symlinks nor trigger an automount.
+AT_SYMLINK_NOFOLLOW = 0x100
+AT_NO_AUTOMOUNT = 0x800
+STATX_FLAGS = AT_SYMLINK_NOFOLLOW | AT_NO_AUTOMOUNT
+
+# Layout of the header of a linux_dirent64 entry: inode, offset, length
+# of the entry and type, followed by the name ending with a null byte.
+DIRENT_HEADER = Struct('=QqHB')
+
+# Layout of the fields of struct statx read from its mode: mode, inode,
+# size, seconds and nanoseconds of the modification time, and major and
+# minor numbers of the device.
+STATX_OFFSET = 28
+STATX_FIELDS = Struct('=H2xQQ64xqI12xII')
+
+# Size in bytes of struct statx.
+STATX_SIZE_BYTES = 256
+
+# A file found by the scanner, with the status needed by the next steps
+# so that each file is only stat'ed once.
+FileRecord = namedtuple('FileRecord',
+                        ['path', 'size', 'inode', 'device', 'mtime_ns'])
+
+# The files kept by the scanner: the glob patterns a file must match and
+# must not match, the extensions it must have, its minimum and maximum
+# size, and the glob patterns of the directories not read.  The patterns
+# are matched against the name and the path of an entry.
+ScanFilter = namedtuple('ScanFilter',
+                        ['include', 'exclude', 'extensions', 'min_size',
+                         'max_size', 'prune'],
+                        defaults=((), (), (), 0, None, ()))
+
+# A group of duplicates read from a content index: the size of its
+# files, the bytes which would be freed by keeping a single copy, the
+# hash of their content if it is known and their paths.
+IndexedGroup = namedtuple('IndexedGroup',
+                          ['size', 'wasted', 'digest', 'paths'])
 
 
 # ---------------------Get Argument From User----------------------
+def positive_int(value):
+    """
+    Convert a number which must be greater than 0 on the command line.
+
+    @param value: The string inputted by the user.
+
+    @return: The number as an integer.
+
+    @raise ArgumentTypeError: if the value is not a positive integer.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise ArgumentTypeError("expected an integer, got %r" % value)
+    if number <= 0:
+        raise ArgumentTypeError("expected a positive integer, got %r"
+                                % value)
+
+    return number
+
+
 def get_argument():
     """
-    Return an absolute path which is inputted
+    Return the arguments which are inputted
     by the user through the command line.
 
-    @return: an absolute path of a directory.
+    @return: an instance of argparse.Namespace with the path of the
+    directory and the options of the scan.
     """
     parser = ArgumentParser(prog="Duplicate Files Finder")
     parser.add_argument('-p', '--path', type=str,
                         required=True, metavar="path")
+    parser.add_argument('--buffer-size', type=positive_int,
+                        default=BUFFER_SIZE,
+                        metavar="bytes",
+                        help="size of the buffer used to read files")
+    parser.add_argument('--mmap-threshold', type=int, default=MMAP_THRESHOLD,
+                        metavar="bytes",
+                        help="minimum size of the files mapped in memory, "
+                             "0 to always read files into a buffer")
+    parser.add_argument('--head-size', type=int, default=HEAD_SIZE,
+                        metavar="bytes",
+                        help="size of the first block compared, 0 to skip")
+    parser.add_argument('--tail-size', type=int, default=TAIL_SIZE,
+                        metavar="bytes",
+                        help="size of the last block compared, 0 to skip")
+    parser.add_argument('--hash', type=str, default=HASH_ALGORITHM,
+                        choices=sorted(HASH_ALGORITHMS) + ['auto'],
+                        help="hash function used to compare the files, "
+                             "auto to use the fastest one on this host")
+    parser.add_argument('--verify', type=str,
+                        choices=sorted(HASH_ALGORITHMS) + ['bytes'],
+                        help="confirm the duplicates found with another "
+                             "hash function or byte by byte")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar="N",
+                        help="number of files hashed at the same time")
+    parser.add_argument('--processes', action='store_true',
+                        help="hash files in processes instead of threads")
+    parser.add_argument('--scan-jobs', type=int, default=1, metavar="N",
+                        help="number of directories read at the same time")
+    parser.add_argument('--scanner', type=str, default='scandir',
+                        choices=SCANNERS,
+                        help="function reading the directories, statx to "
+                             "read them with getdents64 and statx (Linux "
+                             "only)")
+    parser.add_argument('--ndjson', action='store_true',
+                        help="print each group of duplicates on its own "
+                             "line as soon as it is found")
+    parser.add_argument('--separate-links', action='store_true',
+                        help="report the paths linked to the same file "
+                             "apart from the duplicates")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        metavar="N",
+                        help="number of files hashed before printing their "
+                             "groups")
+    parser.add_argument('--cache', type=str, metavar="path",
+                        help="file where the hashes are kept between runs")
+    parser.add_argument('--incremental', type=str, metavar="snapshot",
+                        help="file where the scanned tree is kept between "
+                             "runs, to only read the directories modified "
+                             "since the previous run")
+    parser.add_argument('--cache-size', type=int, default=CACHE_MAX_ENTRIES,
+                        metavar="N",
+                        help="maximum number of hashes kept in the cache")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep watching the directory after the first "
+                             "scan and print the groups of duplicates which "
+                             "change as JSON lines (Linux only)")
+    parser.add_argument('--include', type=str, action='append',
+                        metavar="glob",
+                        help="only keep the files whose name or path "
+                             "matches the pattern, can be repeated")
+    parser.add_argument('--exclude', type=str, action='append',
+                        metavar="glob",
+                        help="skip the files whose name or path matches "
+                             "the pattern, can be repeated")
+    parser.add_argument('--extensions', type=str, metavar="list",
+                        help="comma-separated extensions of the files kept "
+                             "(e.g., \"jpg,png\")")
+    parser.add_argument('--min-size', type=int, default=0, metavar="bytes",
+                        help="minimum size of the files kept")
+    parser.add_argument('--max-size', type=int, metavar="bytes",
+                        help="maximum size of the files kept")
+    parser.add_argument('--prune', type=str, action='append',
+                        metavar="glob",
+                        help="skip the directories whose name or path "
+                             "matches the pattern (e.g., .git), can be "
+                             "repeated")
+    parser.add_argument('--checkpoint', type=str, metavar="path",
+                        help="file where the progress of the run is saved "
+                             "regularly, to be resumed with --resume")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the run saved in the checkpoint "
+                             "where it stopped")
+    parser.add_argument('--checkpoint-interval', type=float,
+                        default=CHECKPOINT_INTERVAL, metavar="seconds",
+                        help="minimum time between two saves of the "
+                             "progress")
+    parser.add_argument('--priority', action='store_true',
+                        help="hash first the files of the sizes which "
+                             "could free the most space")
+    parser.add_argument('--time-budget', type=float, metavar="seconds",
+                        help="stop hashing new files after this time, "
+                             "implies --priority")
+    parser.add_argument('--byte-budget', type=int, metavar="bytes",
+                        help="maximum size of the files hashed, implies "
+                             "--priority")
+    parser.add_argument('--reclaimable', action='store_true',
+                        help="print each group as an object with the bytes "
+                             "freed by keeping a single copy and its paths")
+    parser.add_argument('--index', type=str, metavar="path",
+                        help="file where the files and the groups of "
+                             "duplicates are saved after the run, to be "
+                             "queried with query_duplicate_files.py")
+    parser.add_argument('--stats', action='store_true',
+                        help="print the files, bytes and time of each stage "
+                             "as JSON on stderr")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="add the peak memory and the lines allocating "
+                             "the most memory to the stats report")
+    parser.add_argument('--profile', type=str, metavar="path",
+                        help="file where the cProfile statistics of the run "
+                             "are written")
     args = parser.parse_args()
+    if args.resume and args.checkpoint is None:
+        parser.error("--resume requires --checkpoint")
+    if args.index and args.watch:
+        parser.error("--index can't be used with --watch")
+    # The groups of a snapshot would miss the sizes skipped by a budget
+    if args.incremental and (args.time_budget is not None or
+                             args.byte_budget is not None):
+        parser.error("--time-budget and --byte-budget can't be used with "
+                     "--incremental")
+    # The snapshot and the checkpoint are read one directory at a time
+    if args.incremental and args.scan_jobs > 1:
+        parser.error("--scan-jobs can't be used with --incremental")
+    if args.checkpoint and args.scan_jobs > 1:
+        parser.error("--scan-jobs can't be used with --checkpoint")
+
+    return args
+
+
+# ---------------------Counting the Work Done----------------------
+class ScanStats:
+    """
+    Counters and timers of the work done at each stage of a run: the
+    directories and files scanned, the files and bytes read by each
+    checksum stage, the groups and files left after it, and its wall and
+    CPU time.
+
+    The hooks are called with the name of a stage and its counters each
+    time the stage has done a part of its work, to follow a run while it
+    goes on.
+    """
+
+    def __init__(self, hooks=()):
+        """
+        Create empty counters.
+
+        @param hooks: The functions called with the name of a stage and
+        its counters.
+        """
+        self.hooks = list(hooks)
+        self.stages = {}
+        self.read_sizes = {}
+        self.started = {}
+        # The directories can be read by several threads at the same time
+        self.lock = Lock()
+
+    def add_hook(self, hook):
+        """
+        Call a function each time a stage has done a part of its work.
+
+        @param hook: The function called with the name of a stage and its
+        counters.
+        """
+        self.hooks.append(hook)
+
+    def count(self, stage, **counters):
+        """
+        Add some values to the counters of a stage.
+
+        @param stage: The name of the stage.
+
+        @param counters: The values added to each counter by name.
+
+        @return: The dictionary of the counters of the stage.
+        """
+        with self.lock:
+            stage_counters = self.stages.setdefault(
+                stage, {'wall_time': 0.0, 'cpu_time': 0.0})
+            for name, value in counters.items():
+                stage_counters[name] = stage_counters.get(name, 0) + value
+
+        return stage_counters
+
+    def start(self, stage, read_size=float('inf')):
+        """
+        Start timing a part of the work of a stage.
+
+        @param stage: The name of the stage.
+
+        @param read_size: The number of bytes the stage reads from each
+        file, at most its size.
+        """
+        self.read_sizes[stage] = read_size
+        self.started[stage] = (perf_counter(), process_time())
+
+    def stop(self, stage, groups=None, duplicates=None):
+        """
+        Stop timing a part of the work of a stage and call the hooks.
+
+        @param stage: The name of the stage.
+
+        @param groups: The groups of files the stage has split, None if
+        the stage doesn't split groups.
+
+        @param duplicates: The groups of files left by the stage.
+        """
+        counters = {}
+        if stage in self.started:
+            wall_time, cpu_time = self.started.pop(stage)
+            counters['wall_time'] = perf_counter() - wall_time
+            counters['cpu_time'] = process_time() - cpu_time
+        if groups is not None:
+            counters['groups_in'] = len(groups)
+            counters['files_in'] = sum(map(len, groups))
+            counters['groups_out'] = len(duplicates)
+            counters['files_out'] = sum(map(len, duplicates))
+        stage_counters = self.count(stage, **counters)
+        for hook in self.hooks:
+            hook(stage, stage_counters)
+
+    def scanned(self, records):
+        """
+        Count a directory read by the scanner.  Its stat calls are counted
+        by the scanner itself.
+
+        @param records: The FileRecord of the files of the directory.
+        """
+        self.count('scan', directories=1, files=len(records))
+        self.stop('scan')
+
+    def hashed(self, stage, records, cache_hits=0):
+        """
+        Count the files read by a checksum stage.
+
+        @param stage: The name of the stage.
+
+        @param records: The FileRecord of the files read.
 
-    return args.path
+        @param cache_hits: The number of files whose hash was in the cache.
+        """
+        read_size = self.read_sizes.get(stage, float('inf'))
+        self.count(stage, files_read=len(records), cache_hits=cache_hits,
+                   bytes_read=sum(min(record.size, read_size)
+                                  for record in records))
+
+    def report(self):
+        """
+        Return the counters of all the stages, with the number of bytes
+        read per second by the stages reading files.
+
+        @return: A dictionary of the names of the stages and their
+        counters.
+        """
+        report = {}
+        for stage, counters in self.stages.items():
+            report[stage] = dict(counters)
+            if counters.get('bytes_read') and counters['wall_time']:
+                report[stage]['throughput'] = \
+                    counters['bytes_read'] / counters['wall_time']
+
+        return report
+
+
+def get_memory_report(limit=10):
+    """
+    Return the memory allocated since tracemalloc was started, and stop
+    tracing the allocations.
+
+    @param limit: The number of lines allocating the most memory which
+    are reported.
+
+    @return: A dictionary of the current and peak size of the memory
+    allocated, and of the lines allocating the most memory.
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    statistics = tracemalloc.take_snapshot().statistics('lineno')
+    tracemalloc.stop()
+
+    return {'current': current, 'peak': peak,
+            'top': [{'line': str(statistic.traceback),
+                     'size': statistic.size, 'count': statistic.count}
+                    for statistic in statistics[:limit]]}
 
 
 # ---------------------Get Files From Valid Path-------------------
@@ -55,11 +511,472 @@ def scan_files(path):
 
     @return: a list of files with absolute paths.
     """
-    files = []
-    for root, _, file_list in walk(path):
-        files += get_file_paths(root, file_list)
+    return [record.path for record in scan_file_records(path)]
 
-    return files
+
+def get_file_record(file):
+    """
+    Return the record of a single file.
+
+    @param file: A file's path.
+
+    @return: A FileRecord, or None if the file can't be accessed.
+    """
+    try:
+        file_stat = stat(file)
+    except OSError:
+        return None
+
+    return FileRecord(file, file_stat.st_size, file_stat.st_ino,
+                      file_stat.st_dev, file_stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=None)
+def compile_patterns(patterns):
+    """
+    Return a regular expression matching any of some glob patterns.
+
+    @param patterns: A tuple of glob patterns.
+
+    @return: A compiled regular expression, or None if there is no
+    pattern.
+    """
+    if not patterns:
+        return None
+
+    return re.compile('|'.join('(?:%s)' % translate(pattern)
+                               for pattern in patterns))
+
+
+def create_scan_filter(include=(), exclude=(), extensions=(), min_size=0,
+                       max_size=None, prune=()):
+    """
+    Return the filter of the files kept by the scanner.
+
+    @param include: The glob patterns of the files kept, all the files if
+    empty.
+
+    @param exclude: The glob patterns of the files skipped.
+
+    @param extensions: The extensions of the files kept, with or without
+    their dot, all the files if empty.
+
+    @param min_size: The minimum size in bytes of the files kept.
+
+    @param max_size: The maximum size in bytes of the files kept, None
+    for no maximum.
+
+    @param prune: The glob patterns of the directories not read.
+
+    @return: A ScanFilter, or None if it keeps all the files.
+    """
+    scan_filter = ScanFilter(tuple(include or ()), tuple(exclude or ()),
+                             tuple(extension.lstrip('.').lower()
+                                   for extension in extensions or ()),
+                             min_size or 0, max_size, tuple(prune or ()))
+    if scan_filter == ScanFilter():
+        return None
+
+    return scan_filter
+
+
+def match_entry(patterns, name, path):
+    """
+    Return True if the name or the path of an entry matches a pattern.
+
+    @param patterns: A tuple of glob patterns.
+
+    @param name: The name of the entry.
+
+    @param path: The path of the entry.
+
+    @return: A Boolean value.
+    """
+    regex = compile_patterns(patterns)
+
+    return bool(regex.match(name) or regex.match(path))
+
+
+def is_pruned(name, path, scan_filter):
+    """
+    Return True if a directory is not read by the scanner.
+
+    @param name: The name of the directory.
+
+    @param path: The path of the directory.
+
+    @param scan_filter: The ScanFilter of the scanner.
+
+    @return: A Boolean value.
+    """
+    return bool(scan_filter.prune) and \
+        match_entry(scan_filter.prune, name, path)
+
+
+def is_name_kept(name, path, scan_filter):
+    """
+    Return True if a file is kept by the scanner based on its name and
+    path, before the file is stat'ed.
+
+    @param name: The name of the file.
+
+    @param path: The path of the file.
+
+    @param scan_filter: The ScanFilter of the scanner.
+
+    @return: A Boolean value.
+    """
+    if scan_filter.extensions and \
+            splitext(name)[1][1:].lower() not in scan_filter.extensions:
+        return False
+    if scan_filter.include and \
+            not match_entry(scan_filter.include, name, path):
+        return False
+
+    return not scan_filter.exclude or \
+        not match_entry(scan_filter.exclude, name, path)
+
+
+def is_size_kept(size, scan_filter):
+    """
+    Return True if a file is kept by the scanner based on its size.
+
+    @param size: The size in bytes of the file.
+
+    @param scan_filter: The ScanFilter of the scanner.
+
+    @return: A Boolean value.
+    """
+    return size >= scan_filter.min_size and \
+        (scan_filter.max_size is None or size <= scan_filter.max_size)
+
+
+def scan_directory(directory, scan_filter=None, stats=None):
+    """
+    Return the records of the files and the sub-directories directly
+    inside a directory.
+
+    The type and the status of each entry are taken from os.scandir, which
+    gets them with the directory listing on most systems, so each file is
+    stat'ed at most once.  The files skipped by their name are never
+    stat'ed and the directories pruned are never returned.
+
+    @param directory: An absolute path of a directory.
+
+    @param scan_filter: The ScanFilter of the files kept, None to keep
+    all the files.
+
+    @param stats: The ScanStats counting the stat calls of the files,
+    None to not count them.
+
+    @return: a tuple of a list of FileRecord and a list of the absolute
+    paths of the sub-directories.
+    """
+    records = []
+    sub_directories = []
+    stat_calls = 0
+    try:
+        entries = scandir(directory)
+    # Skip the directories which can't be read
+    except OSError:
+        return records, sub_directories
+    with entries:
+        try:
+            for entry in entries:
+                try:
+                    # Skip the symlink file
+                    if entry.is_symlink():
+                        continue
+                    elif entry.is_dir():
+                        if scan_filter is None or \
+                                not is_pruned(entry.name, entry.path,
+                                              scan_filter):
+                            sub_directories.append(entry.path)
+                        continue
+                    elif scan_filter is not None and \
+                            not is_name_kept(entry.name, entry.path,
+                                             scan_filter):
+                        continue
+                    stat_calls += 1
+                    file_stat = entry.stat()
+                # Skip the files removed since the directory was read
+                except OSError:
+                    continue
+                if scan_filter is not None and \
+                        not is_size_kept(file_stat.st_size, scan_filter):
+                    continue
+                records.append(FileRecord(entry.path, file_stat.st_size,
+                                          file_stat.st_ino, file_stat.st_dev,
+                                          file_stat.st_mtime_ns))
+        # Keep the entries read before the listing failed
+        except OSError:
+            pass
+    if stats is not None:
+        stats.count('scan', stat_calls=stat_calls)
+
+    return records, sub_directories
+
+
+def scan_file_records(path, workers=1, stats=None, scan_filter=None,
+                      scanner=scan_directory):
+    """
+    Generate the records of all files inside all directory specify by
+    a path.
+
+    With a single worker the files come in the same order as os.walk.
+    With more workers, several directories are read at the same time and
+    the files come in the order their directories are read.
+
+    @param path: A path of a directory.
+
+    @param workers: The number of directories read at the same time.
+
+    @param stats: The ScanStats counting the directories and files
+    scanned, None to not count them.
+
+    @param scan_filter: The ScanFilter of the files kept, None to keep
+    all the files.
+
+    @param scanner: The function reading a directory, scan_directory or
+    a StatxScanner.
+
+    @return: a generator of FileRecord with absolute paths.
+    """
+    if workers > 1:
+        yield from scan_file_records_parallel(path, workers, stats,
+                                              scan_filter, scanner)
+        return
+    directories = [abspath(path)]
+    while directories:
+        if stats is not None:
+            stats.start('scan')
+        records, sub_directories = scanner(directories.pop(), scan_filter,
+                                           stats)
+        if stats is not None:
+            stats.scanned(records)
+        yield from records
+        # Visit the sub-directories in their order, depth first
+        directories += reversed(sub_directories)
+
+
+def scan_file_records_parallel(path, workers, stats=None,
+                               scan_filter=None, scanner=scan_directory):
+    """
+    Generate the records of all files inside all directory specify by
+    a path, reading several directories at the same time.
+
+    Each directory read gives the next directories to read to the pool,
+    so the scan is limited by the number of workers rather than by the
+    latency of each directory listing.
+
+    @param path: A path of a directory.
+
+    @param workers: The number of directories read at the same time.
+
+    @param stats: The ScanStats counting the directories and files
+    scanned, None to not count them.
+
+    @param scan_filter: The ScanFilter of the files kept, None to keep
+    all the files.
+
+    @param scanner: The function reading a directory, scan_directory or
+    a StatxScanner.
+
+    @return: a generator of FileRecord with absolute paths.
+    """
+    executor = ThreadPoolExecutor(workers)
+    try:
+        futures = {executor.submit(scanner, abspath(path), scan_filter,
+                                   stats)}
+        while futures:
+            if stats is not None:
+                stats.start('scan')
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                records, sub_directories = future.result()
+                if stats is not None:
+                    stats.scanned(records)
+                futures.update(executor.submit(scanner, directory,
+                                               scan_filter, stats)
+                               for directory in sub_directories)
+                yield from records
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+# ---------------------Accelerated Scanner-------------------------
+class StatxScanner:
+    """
+    Read the entries of a directory with getdents64 and stat its files
+    with statx, through the C library of Linux.
+
+    The entries are read with a large buffer in a few system calls, and
+    each file is stat'ed relative to the open directory, asking only for
+    the fields of a FileRecord.  An instance is called like
+    scan_directory and returns the same records.
+    """
+
+    def __init__(self, buffer_size=GETDENTS_BUFFER_SIZE):
+        """
+        Load getdents64 and statx from the C library.
+
+        @param buffer_size: The size in bytes of the buffer filled by
+        each getdents64 call.
+
+        @raise OSError: if the C library can't be loaded.
+
+        @raise AttributeError: if the C library doesn't have getdents64
+        or statx, outside of Linux or before glibc 2.30.
+
+        @raise ImportError: if directories can't be opened as files on
+        this system.
+        """
+        from os import O_DIRECTORY, O_CLOEXEC
+        self.open_flags = O_RDONLY | O_DIRECTORY | O_CLOEXEC
+        libc = CDLL(find_library('c'), use_errno=True)
+        self.getdents = libc.getdents64
+        self.getdents.argtypes = [c_int, c_void_p, c_size_t]
+        self.statx = libc.statx
+        self.statx.argtypes = [c_int, c_char_p, c_int, c_uint, c_void_p]
+        self.buffer_size = buffer_size
+        # The buffers are reused, one per thread reading directories
+        self.buffers = local()
+
+    def get_buffers(self):
+        """
+        Return the buffers of the current thread.
+
+        @return: A tuple of the buffer of the entries and the buffer of
+        the status of a file.
+        """
+        buffers = getattr(self.buffers, 'value', None)
+        if buffers is None:
+            buffers = (create_string_buffer(self.buffer_size),
+                       create_string_buffer(STATX_SIZE_BYTES))
+            self.buffers.value = buffers
+
+        return buffers
+
+    def iter_entries(self, directory_fd, buffer):
+        """
+        Generate the names and types of the entries of an open directory.
+
+        @param directory_fd: The file descriptor of the directory.
+
+        @param buffer: The buffer filled by getdents64.
+
+        @return: a generator of tuples of the name of an entry in bytes
+        and its type, DT_UNKNOWN if the file system doesn't give it.
+        """
+        while True:
+            length = self.getdents(directory_fd, buffer, self.buffer_size)
+            # Stop at the end of the directory or when it can't be read
+            if length <= 0:
+                return
+            data = string_at(buffer, length)
+            offset = 0
+            while offset < length:
+                _, _, entry_length, entry_type = \
+                    DIRENT_HEADER.unpack_from(data, offset)
+                start = offset + DIRENT_HEADER.size
+                name = data[start:data.index(b'\0', start)]
+                offset += entry_length
+                if name != b'.' and name != b'..':
+                    yield name, entry_type
+
+    def __call__(self, directory, scan_filter=None, stats=None):
+        """
+        Return the records of the files and the sub-directories directly
+        inside a directory.
+
+        @param directory: An absolute path of a directory.
+
+        @param scan_filter: The ScanFilter of the files kept, None to keep
+        all the files.
+
+        @param stats: The ScanStats counting the statx calls, None to not
+        count them.
+
+        @return: a tuple of a list of FileRecord and a list of the absolute
+        paths of the sub-directories.
+        """
+        records = []
+        sub_directories = []
+        stat_calls = 0
+        buffer, status = self.get_buffers()
+        prefix = join(directory, '')
+        try:
+            directory_fd = open_fd(directory, self.open_flags)
+        # Skip the directories which can't be read
+        except OSError:
+            return records, sub_directories
+        try:
+            for raw_name, entry_type in self.iter_entries(directory_fd,
+                                                          buffer):
+                # Skip the symlink file
+                if entry_type == DT_LNK:
+                    continue
+                name = fsdecode(raw_name)
+                path = prefix + name
+                fields = None
+                if entry_type == DT_UNKNOWN:
+                    # The type is only known once the entry is stat'ed
+                    stat_calls += 1
+                    if self.statx(directory_fd, raw_name, STATX_FLAGS,
+                                  STATX_MASK, status) != 0:
+                        continue
+                    fields = STATX_FIELDS.unpack_from(status, STATX_OFFSET)
+                    if S_ISLNK(fields[0]):
+                        continue
+                    if S_ISDIR(fields[0]):
+                        entry_type = DT_DIR
+                if entry_type == DT_DIR:
+                    if scan_filter is None or \
+                            not is_pruned(name, path, scan_filter):
+                        sub_directories.append(path)
+                    continue
+                if scan_filter is not None and \
+                        not is_name_kept(name, path, scan_filter):
+                    continue
+                if fields is None:
+                    # Skip the files removed since the directory was read
+                    stat_calls += 1
+                    if self.statx(directory_fd, raw_name, STATX_FLAGS,
+                                  STATX_MASK, status) != 0:
+                        continue
+                    fields = STATX_FIELDS.unpack_from(status, STATX_OFFSET)
+                _, inode, size, seconds, nanoseconds, major, minor = fields
+                if scan_filter is not None and \
+                        not is_size_kept(size, scan_filter):
+                    continue
+                records.append(FileRecord(path, size, inode,
+                                          makedev(major, minor),
+                                          seconds * 10 ** 9 + nanoseconds))
+        finally:
+            close(directory_fd)
+        if stats is not None:
+            stats.count('scan', stat_calls=stat_calls)
+
+        return records, sub_directories
+
+
+def get_scanner(name='scandir'):
+    """
+    Return the function reading the entries of a directory.
+
+    @param name: The name of the scanner in SCANNERS.
+
+    @return: scan_directory, or a StatxScanner if it is asked for and
+    available on this system.
+    """
+    if name == 'statx':
+        try:
+            return StatxScanner()
+        # Fall back to os.scandir outside of Linux
+        except (OSError, AttributeError, ImportError):
+            pass
+
+    return scan_directory
 
 
 # ---------------------Grouping Based On File-size-----------------
@@ -109,109 +1026,2183 @@ def group_files_by_size(file_path_names):
     return size_list
 
 
-# ---------------------Convert Content to Checksum-----------------
-def get_file_checksum(file):
+def create_record_size_dict(records):
     """
-    Get the hash value from a file's content.
+    Return a dictionary of file records with key is the size and
+    value is the records which have that size.
 
-    @param file: A file's absolute path.
+    @param records: An iterable of FileRecord.
 
-    @return: The hash value of a file.
+    @return: A dictionary of sizes and FileRecord.
     """
-    # Error handling if file has no permission to read.
-    if not access(file, R_OK):
-        return None
-    else:
-        with open(file, 'rb') as data:
-            file_hash = md5(data.read()).hexdigest()
+    size_dict = {}
+    for record in records:
+        # if file is empty
+        if record.size == 0:
+            continue
+        elif record.size in size_dict:
+            size_dict[record.size].append(record)
+        else:
+            size_dict[record.size] = [record]
 
-        return file_hash
+    return size_dict
 
 
-# ---------------------Grouping Based on Checksum------------------
-def create_hash_dict(file_path_names):
+def group_records_by_size(records):
     """
-    Return a dictionary with key is the hash and value is the filepath with
-    that hash.
+    Return a list of groups of file records with the same size, using the
+    size already read by the scanner.
 
-    @param file_path_names: A list of files with absolute paths.
+    @param records: An iterable of FileRecord.
 
-    @return: A dictionary of hashes and filepaths.
+    @return: a list of groups of FileRecord.
     """
-    hash_dict = {}
-    # Create a dict with key is the filehash and
-    # values are the filepath
-    for file in file_path_names:
-        file_hash = get_file_checksum(file)
-        # if the file_hash is not None
-        if file_hash:
-            if file_hash in hash_dict:
-                hash_dict[file_hash].append(file)
-            else:
-                hash_dict[file_hash] = [file]
+    size_dict = create_record_size_dict(records)
 
-    return hash_dict
+    return [group for group in size_dict.values() if len(group) > 1]
 
 
-def group_files_by_checksum(file_path_names):
+# ---------------------Compact File Index--------------------------
+class FileIndex:
     """
-    Return a list of group of files with the same checksum.
+    Compact table of the scanned files.
 
-    @param file_path_names: A list of files with absolute paths.
-    The list being passed in will be sorted by size beforehand for efficiency.
-
-    @return: A list of groups of files.
+    The directories are stored once in a table and each file only keeps
+    the number of its directory and its name, while the sizes, inodes,
+    devices and modification times are stored in arrays of integers
+    instead of Python objects.  The full path of a file is only built
+    when its record is needed to hash it or to print it.
     """
-    hash_list = []
-    hash_dict = create_hash_dict(file_path_names)
-    # Create a list of groups of files that have more
-    # than 2 items
-    for group in hash_dict.values():
-        if len(group) > 1:
-            hash_list.append(group)
 
-    return hash_list
+    def __init__(self, records=()):
+        """
+        Create the index of a list of files.
 
+        @param records: An iterable of FileRecord.
+        """
+        self.directories = []
+        self.directory_ids = {}
+        self.directory_column = array('I')
+        self.names = []
+        self.sizes = array('q')
+        self.inodes = array('Q')
+        self.devices = array('Q')
+        self.mtimes = array('q')
+        for record in records:
+            self.add(record)
 
-# --------Find Duplicate Files Based on Size and Checksum----------
-def find_duplicate_files(file_path_names):
-    """
-    Return a list of groups of duplicates filtered by size and checksum.
+    def __len__(self):
+        """
+        Return the number of files in the index.
+        """
+        return len(self.names)
 
-    @param file_path_names: A list of files with absolute paths.
+    def add(self, record):
+        """
+        Add a file to the index.
 
-    @return: A list of groups of duplicates.
-    """
-    groups = []
-    # Grouping files by size first
-    size_list = group_files_by_size(file_path_names)
-    # Grouping each group by checksum
-    for group in size_list:
-        hash_list = group_files_by_checksum(group)
-        groups += hash_list
+        @param record: The FileRecord of the file.
+        """
+        directory, separator, name = record.path.rpartition(sep)
+        directory += separator
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = len(self.directories)
+            self.directory_ids[directory] = directory_id
+            self.directories.append(directory)
+        self.directory_column.append(directory_id)
+        self.names.append(name)
+        self.sizes.append(record.size)
+        self.inodes.append(record.inode)
+        self.devices.append(record.device)
+        self.mtimes.append(record.mtime_ns)
 
-    return groups
+    def get_path(self, file_id):
+        """
+        Return the path of a file of the index.
+
+        @param file_id: The position of the file in the index.
+
+        @return: The path of the file.
+        """
+        return self.directories[self.directory_column[file_id]] + \
+            self.names[file_id]
+
+    def get_record(self, file_id):
+        """
+        Return the record of a file of the index.
+
+        @param file_id: The position of the file in the index.
+
+        @return: A FileRecord.
+        """
+        return FileRecord(self.get_path(file_id), self.sizes[file_id],
+                          self.inodes[file_id], self.devices[file_id],
+                          self.mtimes[file_id])
+
+    def group_by_size(self):
+        """
+        Return the groups of files with the same size, sorting the column
+        of sizes instead of filling a dictionary.  The groups and the files
+        inside each group are in the order the files were added.
+
+        @return: A list of lists of positions of files in the index, for
+        the sizes shared by more than one non-empty file.
+        """
+        if numpy is not None:
+            sizes = numpy.frombuffer(self.sizes, dtype=numpy.int64)
+            order = numpy.argsort(sizes, kind='stable')
+            sorted_sizes = sizes[order]
+            _, starts, counts = numpy.unique(sorted_sizes, return_index=True,
+                                             return_counts=True)
+            kept = (counts > 1) & (sorted_sizes[starts] > 0)
+            size_list = [order[start:start + count].tolist() for start, count
+                         in zip(starts[kept], counts[kept])]
+        else:
+            sizes = self.sizes
+            order = sorted(range(len(sizes)), key=sizes.__getitem__)
+            size_list = []
+            start = 0
+            for end in range(1, len(order) + 1):
+                if end == len(order) or \
+                        sizes[order[end]] != sizes[order[start]]:
+                    if end - start > 1 and sizes[order[start]] > 0:
+                        size_list.append(order[start:end])
+                    start = end
+        # Keep the groups in the order of their first file
+        size_list.sort(key=lambda file_ids: file_ids[0])
+
+        return size_list
+
+    def get_inode_count(self, file_ids):
+        """
+        Return the number of distinct inodes of a group of files.
+
+        @param file_ids: A list of positions of files in the index.
+
+        @return: The number of inodes, the paths linked to the same inode
+        are counted once.
+        """
+        return len({(self.devices[file_id], self.inodes[file_id])
+                    for file_id in file_ids})
+
+    def sort_by_reclaimable(self, size_list):
+        """
+        Return groups of files with the same size sorted by the bytes which
+        would be freed if all their files were duplicates, the largest
+        first.  The groups freeing the same bytes stay in their order.
+
+        @param size_list: A list of lists of positions of files in the
+        index, as returned by group_by_size.
+
+        @return: A sorted list of the same groups.
+        """
+        return sorted(size_list, key=lambda file_ids: -(
+            self.sizes[file_ids[0]] * (self.get_inode_count(file_ids) - 1)))
+
+    def select_within_bytes(self, size_list, byte_budget):
+        """
+        Return the groups of files with the same size whose files can be
+        read entirely within a number of bytes, taking the groups in their
+        order and skipping the ones which don't fit in the bytes left.
+
+        @param size_list: A list of lists of positions of files in the
+        index.
+
+        @param byte_budget: The maximum number of bytes of all the files
+        of the groups kept, a single path being counted for each inode.
+
+        @return: A tuple of the list of the groups kept and the list of
+        the groups skipped.
+        """
+        selected = []
+        skipped = []
+        for file_ids in size_list:
+            group_bytes = self.sizes[file_ids[0]] * \
+                self.get_inode_count(file_ids)
+            if group_bytes <= byte_budget:
+                selected.append(file_ids)
+                byte_budget -= group_bytes
+            else:
+                skipped.append(file_ids)
+
+        return selected, skipped
+
+
+# ---------------------Convert Content to Checksum-----------------
+def update_hash(file_hash, data, buffer, size=None):
+    """
+    Feed the content of an opened file into a hash object, one buffer
+    at a time, so the memory used does not depend on the file's size.
+
+    @param file_hash: The hash object to be updated.
+
+    @param data: A file opened in binary mode.
+
+    @param buffer: A bytearray reused to receive every chunk of the file.
+
+    @param size: The number of bytes to read, None to read until the end
+    of the file.
+
+    @raise ValueError: if the buffer is empty, nothing would be read.
+    """
+    if not buffer:
+        raise ValueError("the buffer must not be empty")
+    view = memoryview(buffer)
+    while size is None or size > 0:
+        chunk = view if size is None or size >= len(view) else view[:size]
+        length = data.readinto(chunk)
+        if not length:
+            break
+        file_hash.update(chunk[:length])
+        if size is not None:
+            size -= length
+
+
+def update_hash_mapped(file_hash, data, buffer_size=BUFFER_SIZE):
+    """
+    Feed the content of an opened file into a hash object from a memory
+    mapping of the file, without copying it into a buffer.
+
+    @param file_hash: The hash object to be updated.
+
+    @param data: A file opened in binary mode.
+
+    @param buffer_size: The size in bytes of the slices of the mapping
+    given to the hash object.
+    """
+    with mmap(data.fileno(), 0, access=ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            for offset in range(0, len(view), buffer_size):
+                file_hash.update(view[offset:offset + buffer_size])
+
+
+def is_mapped(data, mmap_threshold=MMAP_THRESHOLD):
+    """
+    Return True if an opened file is big enough to be mapped in memory.
+
+    @param data: A file opened in binary mode.
+
+    @param mmap_threshold: The minimum size in bytes of the files mapped
+    in memory, 0 to never map them.
+
+    @return: A Boolean value.
+    """
+    return 0 < mmap_threshold <= fstat(data.fileno()).st_size
+
+
+def get_file_checksum(file, buffer_size=BUFFER_SIZE,
+                      algorithm=HASH_ALGORITHM,
+                      mmap_threshold=MMAP_THRESHOLD):
+    """
+    Get the hash value from a file's content.
+
+    @param file: A file's absolute path.
+
+    @param buffer_size: The size in bytes of the chunks read from the file.
+
+    @param algorithm: The name of the hash function in HASH_ALGORITHMS.
+
+    @param mmap_threshold: The minimum size in bytes of the files mapped
+    in memory instead of being read into a buffer, 0 to never map them.
+
+    @return: The hash value of a file.
+
+    @raise ValueError: if the buffer size is not positive.
+    """
+    if buffer_size <= 0:
+        raise ValueError("the buffer size must be positive")
+    # Error handling if file has no permission to read.
+    if not access(file, R_OK):
+        return None
+    else:
+        file_hash = HASH_ALGORITHMS[algorithm]()
+        with open(file, 'rb', buffering=0) as data:
+            if is_mapped(data, mmap_threshold):
+                update_hash_mapped(file_hash, data, buffer_size)
+            else:
+                update_hash(file_hash, data, bytearray(buffer_size))
+
+        return file_hash.hexdigest()
+
+
+def get_block_checksum(file, buffer_size=BUFFER_SIZE,
+                       block_size=HEAD_SIZE, from_end=False,
+                       algorithm=HASH_ALGORITHM):
+    """
+    Get the hash value from a block at the beginning or at the end of
+    a file's content.
+
+    @param file: A file's absolute path.
+
+    @param buffer_size: The size in bytes of the chunks read from the file.
+
+    @param block_size: The size in bytes of the block to hash.
+
+    @param from_end: True to hash the last block of the file instead of
+    the first one.
+
+    @param algorithm: The name of the hash function in HASH_ALGORITHMS.
+
+    @return: The hash value of the block.
+    """
+    # Error handling if file has no permission to read.
+    if not access(file, R_OK):
+        return None
+    else:
+        file_hash = HASH_ALGORITHMS[algorithm]()
+        with open(file, 'rb', buffering=0) as data:
+            # Files smaller than the block are hashed entirely
+            if from_end and data.seek(0, SEEK_END) > block_size:
+                data.seek(-block_size, SEEK_END)
+            else:
+                data.seek(0)
+            update_hash(file_hash, data,
+                        bytearray(min(buffer_size, block_size)), block_size)
+
+        return file_hash.hexdigest()
+
+
+def get_checksum_stages(head_size=HEAD_SIZE, tail_size=TAIL_SIZE,
+                        algorithm=HASH_ALGORITHM,
+                        mmap_threshold=MMAP_THRESHOLD):
+    """
+    Return the checksum functions used one after another to split a group
+    of files with the same size, from the cheapest to the most expensive.
+
+    @param head_size: The size in bytes of the first block hashed,
+    0 to skip this stage.
+
+    @param tail_size: The size in bytes of the last block hashed,
+    0 to skip this stage.
+
+    @param algorithm: The name of the hash function in HASH_ALGORITHMS.
+
+    @param mmap_threshold: The minimum size in bytes of the files mapped
+    in memory to hash their whole content, 0 to never map them.
+
+    @return: A list of tuples of the name of the stage, a checksum
+    function and the number of bytes from the beginning and the end of
+    a file compared once this stage and the previous ones are done.
+    """
+    stages = []
+    compared_size = 0
+    if head_size > 0:
+        compared_size += head_size
+        stages.append(('%s:head:%d' % (algorithm, head_size),
+                       partial(get_block_checksum, block_size=head_size,
+                               algorithm=algorithm),
+                       compared_size))
+    if tail_size > 0:
+        compared_size += tail_size
+        stages.append(('%s:tail:%d' % (algorithm, tail_size),
+                       partial(get_block_checksum, block_size=tail_size,
+                               from_end=True, algorithm=algorithm),
+                       compared_size))
+    stages.append(('%s:full' % algorithm,
+                   partial(get_file_checksum, algorithm=algorithm,
+                           mmap_threshold=mmap_threshold),
+                   float('inf')))
+
+    return stages
+
+
+# ---------------------Choosing the Hash Algorithm-----------------
+def benchmark_hash_algorithms(algorithms=None, data_size=BENCHMARK_SIZE,
+                              rounds=3):
+    """
+    Return the speed of the hash functions on this host.
+
+    @param algorithms: The names of the hash functions to measure, None
+    for all the functions in HASH_ALGORITHMS.
+
+    @param data_size: The size in bytes of the data hashed.
+
+    @param rounds: The number of times the data is hashed, the fastest
+    time is kept.
+
+    @return: A dictionary with key is the name of the hash function and
+    value is its speed in bytes per second.
+    """
+    data = memoryview(bytes(range(256)) * (data_size // 256))
+    speeds = {}
+    for algorithm in algorithms or sorted(HASH_ALGORITHMS):
+        best_time = float('inf')
+        for _ in range(rounds):
+            start = perf_counter()
+            file_hash = HASH_ALGORITHMS[algorithm]()
+            for offset in range(0, len(data), BUFFER_SIZE):
+                file_hash.update(data[offset:offset + BUFFER_SIZE])
+            file_hash.hexdigest()
+            best_time = min(best_time, perf_counter() - start)
+        speeds[algorithm] = len(data) / max(best_time, 1e-9)
+
+    return speeds
+
+
+def get_fastest_algorithm(algorithms=None):
+    """
+    Return the name of the fastest hash function on this host.
+
+    @param algorithms: The names of the hash functions to choose from,
+    None for all the functions in HASH_ALGORITHMS.
+
+    @return: The name of a hash function in HASH_ALGORITHMS.
+    """
+    speeds = benchmark_hash_algorithms(algorithms)
+
+    return max(speeds, key=speeds.get)
+
+
+# ---------------------Byte to Byte Comparison---------------------
+def compare_views(view1, view2):
+    """
+    Return True if 2 memoryviews of bytes have the same content.
+
+    The views are compared 8 bytes at a time, which is much faster than
+    comparing memoryviews of bytes and doesn't copy them.
+
+    @param view1, view2: The 2 memoryviews.
+
+    @return: A Boolean value.
+    """
+    if len(view1) != len(view2):
+        return False
+    aligned = len(view1) - len(view1) % 8
+
+    return view1[:aligned].cast('Q') == view2[:aligned].cast('Q') and \
+        view1[aligned:].tobytes() == view2[aligned:].tobytes()
+
+
+def compare_mapped_files(data1, data2, buffer_size=BUFFER_SIZE):
+    """
+    Return True if 2 opened files have the same content, comparing their
+    memory mappings slice by slice without copying them.
+
+    @param data1, data2: The 2 files opened in binary mode.
+
+    @param buffer_size: The size in bytes of the slices compared.
+
+    @return: A Boolean value.
+    """
+    with mmap(data1.fileno(), 0, access=ACCESS_READ) as mapped1, \
+            mmap(data2.fileno(), 0, access=ACCESS_READ) as mapped2:
+        if len(mapped1) != len(mapped2):
+            return False
+        with memoryview(mapped1) as view1, memoryview(mapped2) as view2:
+            for offset in range(0, len(view1), buffer_size):
+                end = offset + buffer_size
+                if not compare_views(view1[offset:end], view2[offset:end]):
+                    return False
+
+    return True
+
+
+def compare_files(file1, file2, buffer_size=BUFFER_SIZE,
+                  mmap_threshold=MMAP_THRESHOLD):
+    """
+    Return True if 2 files have the same content, reading them chunk by
+    chunk and stopping at the first different chunk.
+
+    @param file1, file2: The path of the 2 files.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param mmap_threshold: The minimum size in bytes of the files mapped
+    in memory instead of being read into a buffer, 0 to never map them.
+
+    @return: A Boolean value, False if one of the files can't be read.
+
+    @raise ValueError: if the buffer size is not positive.
+    """
+    if buffer_size <= 0:
+        raise ValueError("the buffer size must be positive")
+    try:
+        with open(file1, 'rb', buffering=0) as data1, \
+                open(file2, 'rb', buffering=0) as data2:
+            if is_mapped(data1, mmap_threshold):
+                return compare_mapped_files(data1, data2, buffer_size)
+            buffer1 = memoryview(bytearray(buffer_size))
+            buffer2 = memoryview(bytearray(buffer_size))
+            while True:
+                length1 = data1.readinto(buffer1)
+                length2 = data2.readinto(buffer2)
+                if not compare_views(buffer1[:length1], buffer2[:length2]):
+                    return False
+                elif not length1:
+                    return True
+    except (OSError, ValueError):
+        return False
+
+
+def split_group_by_content(group, buffer_size=BUFFER_SIZE,
+                           mmap_threshold=MMAP_THRESHOLD):
+    """
+    Return the groups of files with the same content inside a group of
+    files, comparing them byte to byte.
+
+    @param group: A list of FileRecord, most likely all duplicates.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param mmap_threshold: The minimum size in bytes of the files mapped
+    in memory instead of being read into a buffer, 0 to never map them.
+
+    @return: A list of groups of FileRecord.
+    """
+    groups = []
+    remaining = group
+    while len(remaining) > 1:
+        same = [remaining[0]]
+        different = []
+        for record in remaining[1:]:
+            if compare_files(remaining[0].path, record.path, buffer_size,
+                             mmap_threshold):
+                same.append(record)
+            else:
+                different.append(record)
+        if len(same) > 1:
+            groups.append(same)
+        remaining = different
+
+    return groups
+
+
+# ---------------------Hashing Files in Parallel-------------------
+def create_executor(jobs=1, processes=False):
+    """
+    Return the pool of workers used to hash the files.
+
+    @param jobs: The number of files hashed at the same time.
+
+    @param processes: True to hash the files in processes instead of
+    threads, for the hash functions which do not release the GIL.
+
+    @return: An executor, or None if the files are hashed one at a time.
+    """
+    if jobs <= 1:
+        return None
+    elif processes:
+        return ProcessPoolExecutor(jobs)
+    else:
+        return ThreadPoolExecutor(jobs)
+
+
+def get_checksums(file_path_names, buffer_size=BUFFER_SIZE,
+                  get_checksum=get_file_checksum, executor=None):
+    """
+    Return the hashes of a list of files, in the same order as the files.
+
+    @param file_path_names: A list of files with absolute paths.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param get_checksum: The function returning the hash of a file.
+
+    @param executor: The pool of workers hashing the files, None to hash
+    them one at a time.
+
+    @return: A list of hashes.
+    """
+    if executor is None:
+        return [get_checksum(file, buffer_size) for file in file_path_names]
+    # The chunk size is only used by the processes, threads ignore it
+    return list(executor.map(get_checksum, file_path_names,
+                             repeat(buffer_size), chunksize=CHUNK_SIZE))
+
+
+# ---------------------Persistent Hash Cache-----------------------
+class HashCache:
+    """
+    Hashes of the files kept in a SQLite database between two runs.
+
+    A hash is identified by the device and the inode of the file and
+    by the name of the checksum stage, and is only used while the size
+    and the modification time of the file are unchanged.  The least
+    recently used hashes are removed when the cache is closed with more
+    than its maximum number of entries, the hashes used being marked by
+    batches of CACHE_USED_BATCH.
+
+    With a checkpoint interval, the hashes are also saved while the cache
+    is used, so the hashes of a run which is stopped are not lost.
+    """
+
+    def __init__(self, path, max_entries=CACHE_MAX_ENTRIES,
+                 checkpoint_interval=None):
+        """
+        Open the cache, creating the database if it doesn't exist.
+
+        @param path: The path of the database file.
+
+        @param max_entries: The maximum number of hashes kept in the cache.
+
+        @param checkpoint_interval: The minimum number of seconds between
+        two saves of the hashes, None to only save them when the cache is
+        closed.
+        """
+        self.max_entries = max_entries
+        self.checkpoint_interval = checkpoint_interval
+        self.run_time = int(time())
+        self.saved = time()
+        self.used_keys = []
+        self.connection = connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS checksums ('
+            'device INTEGER, inode INTEGER, stage TEXT, size INTEGER, '
+            'mtime_ns INTEGER, digest TEXT, used INTEGER, '
+            'PRIMARY KEY (device, inode, stage))')
+
+    def get(self, stage, record):
+        """
+        Return the hash of a file if it has not changed since it was stored.
+
+        @param stage: The name of the checksum stage.
+
+        @param record: The FileRecord of the file.
+
+        @return: The hash of the file, or None if it is unknown or stale.
+        """
+        key = (record.device, record.inode, stage)
+        row = self.connection.execute(
+            'SELECT size, mtime_ns, digest FROM checksums '
+            'WHERE device = ? AND inode = ? AND stage = ?', key).fetchone()
+        # The file has been modified or replaced since it was hashed
+        if row is None or row[:2] != (record.size, record.mtime_ns):
+            return None
+        self.used_keys.append(key)
+        if len(self.used_keys) >= CACHE_USED_BATCH:
+            self.mark_used()
+
+        return row[2]
+
+    def mark_used(self):
+        """
+        Mark the hashes used since the previous call as used by this run.
+        """
+        self.connection.executemany(
+            'UPDATE checksums SET used = ? '
+            'WHERE device = ? AND inode = ? AND stage = ?',
+            ((self.run_time,) + key for key in self.used_keys))
+        self.used_keys = []
+
+    def set(self, stage, record, digest):
+        """
+        Store the hash of a file, replacing the previous one.
+
+        @param stage: The name of the checksum stage.
+
+        @param record: The FileRecord of the file.
+
+        @param digest: The hash of the file.
+        """
+        self.connection.execute(
+            'INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (record.device, record.inode, stage, record.size,
+             record.mtime_ns, digest, self.run_time))
+        # Save the hashes from time to time, a single commit for all the
+        # hashes set since the previous one
+        if self.checkpoint_interval is not None and \
+                time() - self.saved >= self.checkpoint_interval:
+            self.connection.commit()
+            self.saved = time()
+
+    def close(self):
+        """
+        Mark the hashes used during this run, remove the least recently
+        used hashes above the maximum size and save the cache.
+        """
+        self.mark_used()
+        count, = self.connection.execute(
+            'SELECT COUNT(*) FROM checksums').fetchone()
+        if count > self.max_entries:
+            self.connection.execute(
+                'DELETE FROM checksums WHERE rowid IN (SELECT rowid '
+                'FROM checksums ORDER BY used LIMIT ?)',
+                (count - self.max_entries,))
+        self.connection.commit()
+        self.connection.close()
+
+
+def get_cached_checksums(records, buffer_size=BUFFER_SIZE,
+                         get_checksum=get_file_checksum, executor=None,
+                         cache=None, stage='full', stats=None):
+    """
+    Return the hashes of a list of files, in the same order as the files,
+    only hashing the files whose hash is not in the cache.
+
+    @param records: A list of FileRecord.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param get_checksum: The function returning the hash of a file.
+
+    @param executor: The pool of workers hashing the files, None to hash
+    them one at a time.
+
+    @param cache: The HashCache storing the hashes, None to hash every file.
+
+    @param stage: The name of the checksum stage in the cache.
+
+    @param stats: The ScanStats counting the files hashed, None to not
+    count them.
+
+    @return: A list of hashes.
+    """
+    if cache is None:
+        if stats is not None:
+            stats.hashed(stage, records)
+        return get_checksums([record.path for record in records],
+                             buffer_size, get_checksum, executor)
+    hashes = [cache.get(stage, record) for record in records]
+    # Hash the files missing from the cache and store their hash
+    missing = [index for index, file_hash in enumerate(hashes)
+               if file_hash is None]
+    if stats is not None:
+        stats.hashed(stage, [records[index] for index in missing],
+                     len(records) - len(missing))
+    missing_hashes = get_checksums([records[index].path
+                                    for index in missing],
+                                   buffer_size, get_checksum, executor)
+    for index, file_hash in zip(missing, missing_hashes):
+        hashes[index] = file_hash
+        if file_hash:
+            cache.set(stage, records[index], file_hash)
+
+    return hashes
+
+
+# ---------------------Grouping Based on Checksum------------------
+def create_hash_dict(file_path_names, buffer_size=BUFFER_SIZE,
+                     get_checksum=get_file_checksum, executor=None):
+    """
+    Return a dictionary with key is the hash and value is the filepath with
+    that hash.
+
+    @param file_path_names: A list of files with absolute paths.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param get_checksum: The function returning the hash of a file.
+
+    @param executor: The pool of workers hashing the files, None to hash
+    them one at a time.
+
+    @return: A dictionary of hashes and filepaths.
+    """
+    hashes = get_checksums(file_path_names, buffer_size,
+                           get_checksum, executor)
+
+    return build_hash_dict(file_path_names, hashes)
+
+
+def build_hash_dict(file_path_names, hashes):
+    """
+    Return a dictionary with key is the hash and value is the filepath with
+    that hash, from the hashes already computed.
+
+    @param file_path_names: A list of files with absolute paths.
+
+    @param hashes: The list of hashes of the files, in the same order.
+
+    @return: A dictionary of hashes and filepaths.
+    """
+    hash_dict = {}
+    # Create a dict with key is the filehash and
+    # values are the filepath
+    for file, file_hash in zip(file_path_names, hashes):
+        # if the file_hash is not None
+        if file_hash:
+            if file_hash in hash_dict:
+                hash_dict[file_hash].append(file)
+            else:
+                hash_dict[file_hash] = [file]
+
+    return hash_dict
+
+
+def group_files_by_checksum(file_path_names, buffer_size=BUFFER_SIZE,
+                            get_checksum=get_file_checksum, executor=None):
+    """
+    Return a list of group of files with the same checksum.
+
+    @param file_path_names: A list of files with absolute paths.
+    The list being passed in will be sorted by size beforehand for efficiency.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param get_checksum: The function returning the hash of a file.
+
+    @param executor: The pool of workers hashing the files, None to hash
+    them one at a time.
+
+    @return: A list of groups of files.
+    """
+    hash_dict = create_hash_dict(file_path_names, buffer_size,
+                                 get_checksum, executor)
+
+    return get_hash_groups(hash_dict)
+
+
+def get_hash_groups(hash_dict):
+    """
+    Return the groups of files of a hash dictionary that have more than
+    one file.
+
+    @param hash_dict: A dictionary of hashes and filepaths.
+
+    @return: A list of groups of files.
+    """
+    hash_list = []
+    # Create a list of groups of files that have more
+    # than 2 items
+    for group in hash_dict.values():
+        if len(group) > 1:
+            hash_list.append(group)
+
+    return hash_list
+
+
+def split_groups_by_checksum(groups, buffer_size=BUFFER_SIZE,
+                             get_checksum=get_file_checksum, executor=None,
+                             cache=None, stage='full', stats=None):
+    """
+    Return the groups of files with the same checksum inside each group,
+    hashing the files of all the groups together so the workers are kept
+    busy across groups.
+
+    @param groups: A list of groups of FileRecord.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param get_checksum: The function returning the hash of a file.
+
+    @param executor: The pool of workers hashing the files, None to hash
+    them one at a time.
+
+    @param cache: The HashCache storing the hashes, None to hash every file.
+
+    @param stage: The name of the checksum stage in the cache.
+
+    @param stats: The ScanStats counting the files hashed, None to not
+    count them.
+
+    @return: A list with the list of groups of FileRecord found in each
+    group.
+    """
+    records = [record for group in groups for record in group]
+    hashes = get_cached_checksums(records, buffer_size, get_checksum,
+                                  executor, cache, stage, stats)
+    hash_lists = []
+    start = 0
+    for group in groups:
+        end = start + len(group)
+        hash_dict = build_hash_dict(group, hashes[start:end])
+        hash_lists.append(get_hash_groups(hash_dict))
+        start = end
+
+    return hash_lists
+
+
+def verify_groups(groups, verify, buffer_size=BUFFER_SIZE, executor=None,
+                  cache=None, mmap_threshold=MMAP_THRESHOLD, stats=None):
+    """
+    Return the groups of duplicates confirmed by a second comparison,
+    after a first comparison with a fast hash function.
+
+    @param groups: A list of groups of FileRecord of duplicates.
+
+    @param verify: The name of the hash function in HASH_ALGORITHMS used
+    to confirm the duplicates, or 'bytes' to compare them byte to byte.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param executor: The pool of workers reading the files, None to read
+    them one at a time.
+
+    @param cache: The HashCache storing the hashes of the files between
+    runs, None to hash every file.
+
+    @param mmap_threshold: The minimum size in bytes of the files mapped
+    in memory instead of being read into a buffer, 0 to never map them.
+
+    @param stats: The ScanStats timing the verification, None to not
+    time it.
+
+    @return: A list of groups of FileRecord of duplicates.
+    """
+    stage = '%s:full' % verify
+    if stats is not None:
+        stats.start(stage)
+    if verify == 'bytes':
+        if stats is not None:
+            stats.hashed(stage, [record for group in groups
+                                 for record in group])
+        if executor is None:
+            splits = [split_group_by_content(group, buffer_size,
+                                             mmap_threshold)
+                      for group in groups]
+        else:
+            splits = executor.map(split_group_by_content, groups,
+                                  repeat(buffer_size),
+                                  repeat(mmap_threshold))
+    else:
+        splits = split_groups_by_checksum(
+            groups, buffer_size,
+            partial(get_file_checksum, algorithm=verify,
+                    mmap_threshold=mmap_threshold),
+            executor, cache, stage, stats)
+    verified = [group for split in splits for group in split]
+    if stats is not None:
+        stats.stop(stage, groups, verified)
+
+    return verified
+
+
+# ---------------------Grouping Based on Inode---------------------
+def collapse_hardlinks(group):
+    """
+    Return the files of a group with only one file per inode, so the
+    paths linked to the same data are hashed only once.
+
+    @param group: A list of FileRecord with the same size.
+
+    @return: A tuple of the list of FileRecord with one file per inode
+    and a dictionary with key is the file kept for an inode and value is
+    the list of all the FileRecord linked to that inode.
+    """
+    inode_dict = {}
+    for record in group:
+        key = (record.device, record.inode)
+        if key in inode_dict:
+            inode_dict[key].append(record)
+        else:
+            inode_dict[key] = [record]
+    records = [linked[0] for linked in inode_dict.values()]
+    links = {linked[0]: linked for linked in inode_dict.values()
+             if len(linked) > 1}
+
+    return records, links
+
+
+def merge_hardlinks(size_list, groups, links):
+    """
+    Return the groups of duplicates with all the paths linked to their
+    files, and the paths linked to the same inode as groups of their own,
+    in the order of the files in the size groups.
+
+    @param size_list: The list of groups of FileRecord with the same size
+    the duplicates come from.
+
+    @param groups: The list of groups of FileRecord of duplicates, with
+    one file per inode.
+
+    @param links: A dictionary of the files kept for an inode and all the
+    FileRecord linked to that inode.
+
+    @return: A list of groups of FileRecord of duplicates.
+    """
+    if not links:
+        return groups
+    positions = {record: index for index, record in
+                 enumerate(record for group in size_list for record in group)}
+    merged = []
+    grouped = set()
+    for group in groups:
+        grouped.update(group)
+        files = [linked for record in group
+                 for linked in links.get(record, [record])]
+        merged.append(sorted(files, key=positions.get))
+    merged += [linked for record, linked in links.items()
+               if record not in grouped]
+    merged.sort(key=lambda files: positions[files[0]])
+
+    return merged
+
+
+def get_reclaimable_size(group):
+    """
+    Return the bytes freed by keeping a single copy of a group of
+    duplicates.
+
+    @param group: A group of FileRecord of duplicates.
+
+    @return: The size of the files times the number of their inodes
+    minus one, the paths linked to the same inode don't take any space.
+    """
+    inodes = {(record.device, record.inode) for record in group}
+
+    return group[0].size * (len(inodes) - 1)
+
+
+def is_linked_group(group):
+    """
+    Return True if all the files of a group are linked to the same inode.
+
+    @param group: A list of FileRecord.
+
+    @return: A Boolean value.
+    """
+    return len({(record.device, record.inode) for record in group}) == 1
+
+
+# --------Find Duplicate Files Based on Size and Checksum----------
+def find_duplicate_files(file_path_names, buffer_size=BUFFER_SIZE,
+                         head_size=HEAD_SIZE, tail_size=TAIL_SIZE,
+                         jobs=1, processes=False, cache=None):
+    """
+    Return a list of groups of duplicates filtered by size and checksum.
+
+    @param file_path_names: A list of files with absolute paths.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param head_size: The size in bytes of the first block compared before
+    the whole content, 0 to skip this stage.
+
+    @param tail_size: The size in bytes of the last block compared before
+    the whole content, 0 to skip this stage.
+
+    @param jobs: The number of files hashed at the same time.
+
+    @param processes: True to hash the files in processes instead of
+    threads.
+
+    @param cache: The HashCache storing the hashes of the files between
+    runs, None to hash every file.
+
+    @return: A list of groups of duplicates.
+    """
+    records = [record for record in map(get_file_record, file_path_names)
+               if record]
+    groups = find_duplicate_records(records, buffer_size, head_size,
+                                    tail_size, jobs, processes, cache)
+
+    return [[record.path for record in group] for group in groups]
+
+
+def find_duplicate_records(records, buffer_size=BUFFER_SIZE,
+                           head_size=HEAD_SIZE, tail_size=TAIL_SIZE,
+                           jobs=1, processes=False, cache=None,
+                           merge_links=True, algorithm=HASH_ALGORITHM,
+                           verify=None, mmap_threshold=MMAP_THRESHOLD):
+    """
+    Return a list of groups of duplicates filtered by size and checksum,
+    from the records of the scanned files.
+
+    @param records: An iterable of FileRecord.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param head_size: The size in bytes of the first block compared before
+    the whole content, 0 to skip this stage.
+
+    @param tail_size: The size in bytes of the last block compared before
+    the whole content, 0 to skip this stage.
+
+    @param jobs: The number of files hashed at the same time.
+
+    @param processes: True to hash the files in processes instead of
+    threads.
+
+    @param cache: The HashCache storing the hashes of the files between
+    runs, None to hash every file.
+
+    @param merge_links: True to put the paths linked to the same inode
+    in the groups of duplicates, False to keep one path per inode in the
+    groups of duplicates and return the linked paths as separate groups.
+
+    @param algorithm: The name of the hash function in HASH_ALGORITHMS.
+
+    @param verify: The name of the hash function in HASH_ALGORITHMS used
+    to confirm the duplicates, 'bytes' to compare them byte to byte, or
+    None to trust the first hash function.
+
+    @param mmap_threshold: The minimum size in bytes of the files mapped
+    in memory instead of being read into a buffer, 0 to never map them.
+
+    @return: A list of groups of FileRecord of duplicates.
+    """
+    return list(iter_duplicate_records(records, buffer_size, head_size,
+                                       tail_size, jobs, processes, cache,
+                                       merge_links=merge_links,
+                                       algorithm=algorithm, verify=verify,
+                                       mmap_threshold=mmap_threshold))
+
+
+def iter_duplicate_records(records, buffer_size=BUFFER_SIZE,
+                           head_size=HEAD_SIZE, tail_size=TAIL_SIZE,
+                           jobs=1, processes=False, cache=None,
+                           batch_size=BATCH_SIZE, merge_links=True,
+                           algorithm=HASH_ALGORITHM, verify=None,
+                           mmap_threshold=MMAP_THRESHOLD, stats=None,
+                           priority=False, time_budget=None,
+                           byte_budget=None, stopped=None):
+    """
+    Generate the groups of duplicates filtered by size and checksum,
+    from the records of the scanned files.
+
+    Once the files are grouped by size, the size groups are hashed by
+    batches and the groups of duplicates of a batch are generated as soon
+    as the batch is done, without waiting for the other batches.  The
+    paths linked to the same inode are only hashed once.
+
+    With a priority, the size groups which would free the most bytes if
+    all their files were duplicates are hashed first, so a search stopped
+    by a budget has found the duplicates taking the most space.
+
+    @param records: An iterable of FileRecord.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param head_size: The size in bytes of the first block compared before
+    the whole content, 0 to skip this stage.
+
+    @param tail_size: The size in bytes of the last block compared before
+    the whole content, 0 to skip this stage.
+
+    @param jobs: The number of files hashed at the same time.
+
+    @param processes: True to hash the files in processes instead of
+    threads.
+
+    @param cache: The HashCache storing the hashes of the files between
+    runs, None to hash every file.
+
+    @param batch_size: The minimum number of files hashed together before
+    their groups of duplicates are generated.
+
+    @param merge_links: True to put the paths linked to the same inode
+    in the groups of duplicates, False to keep one path per inode in the
+    groups of duplicates and generate the linked paths as separate groups.
+
+    @param algorithm: The name of the hash function in HASH_ALGORITHMS.
+
+    @param verify: The name of the hash function in HASH_ALGORITHMS used
+    to confirm the duplicates, 'bytes' to compare them byte to byte, or
+    None to trust the first hash function.
+
+    @param mmap_threshold: The minimum size in bytes of the files mapped
+    in memory instead of being read into a buffer, 0 to never map them.
+
+    @param stats: The ScanStats counting the files and the bytes read at
+    each stage, None to not count them.  The size groups skipped because
+    of a budget are counted in the 'budget' stage.
+
+    @param priority: True to hash the size groups freeing the most bytes
+    first, False to hash them in the order of their first file.
+
+    @param time_budget: The number of seconds after which no other file
+    is hashed, from the start of the search and the scan included, None
+    for no limit.  The time is checked before each size group, hashed
+    alone, and before each checksum stage, and a size group which is not
+    finished in time is skipped.
+
+    @param byte_budget: The maximum number of bytes of the files hashed,
+    None for no limit.  The size groups whose files don't fit in the
+    bytes left are skipped.
+
+    @param stopped: The threading.Event stopping the search before the
+    next batch or checksum stage once it is set, None to never stop.
+
+    @return: A generator of groups of FileRecord of duplicates.
+    """
+    deadline = None
+    if time_budget is not None:
+        deadline = perf_counter() + time_budget
+        # Check the time left before each size group
+        batch_size = 1
+    stages = get_checksum_stages(head_size, tail_size, algorithm,
+                                 mmap_threshold)
+    # Grouping files by size first, keeping only a compact index of
+    # the files until they are hashed
+    index = FileIndex(records)
+    if stats is not None:
+        stats.start('size')
+    size_list = index.group_by_size()
+    if stats is not None:
+        stats.stop('size', [range(len(index))], size_list)
+    if priority:
+        size_list = index.sort_by_reclaimable(size_list)
+    skipped = []
+    if byte_budget is not None:
+        size_list, skipped = index.select_within_bytes(size_list,
+                                                       byte_budget)
+    executor = create_executor(jobs, processes)
+    try:
+        batches = list(get_size_batches(size_list, batch_size))
+        for batch_number, file_ids in enumerate(batches):
+            if stopped is not None and stopped.is_set():
+                return
+            if deadline is not None and perf_counter() >= deadline:
+                skipped += [group for batch in batches[batch_number:]
+                            for group in batch]
+                break
+            batch = [[index.get_record(file_id) for file_id in group]
+                     for group in file_ids]
+            # Hash a single path for each inode
+            links = {}
+            inode_list = []
+            for group in batch:
+                records, group_links = collapse_hardlinks(group)
+                links.update(group_links)
+                if len(records) > 1:
+                    inode_list.append(records)
+            unfinished = []
+            groups = split_size_groups(inode_list, stages, buffer_size,
+                                       executor, cache, stats, deadline,
+                                       unfinished, stopped)
+            if stopped is not None and stopped.is_set():
+                return
+            # The duplicates are only confirmed if there is time left
+            if unfinished or verify and deadline is not None and \
+                    perf_counter() >= deadline:
+                skipped += file_ids
+                continue
+            if verify:
+                groups = verify_groups(groups, verify, buffer_size,
+                                       executor, cache, mmap_threshold,
+                                       stats)
+            if merge_links:
+                yield from merge_hardlinks(batch, groups, links)
+            else:
+                yield from links.values()
+                yield from groups
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if stats is not None and skipped:
+            stats.count('budget', groups_skipped=len(skipped),
+                        files_skipped=sum(map(len, skipped)))
+
+
+def get_size_batches(size_list, batch_size=BATCH_SIZE):
+    """
+    Generate the batches of groups of files with the same size hashed
+    together.
+
+    @param size_list: A list of groups of FileRecord with the same size.
+
+    @param batch_size: The minimum number of files in a batch, except for
+    the last one.
+
+    @return: A generator of lists of groups of FileRecord.
+    """
+    batch = []
+    file_count = 0
+    for group in size_list:
+        batch.append(group)
+        file_count += len(group)
+        if file_count >= batch_size:
+            yield batch
+            batch = []
+            file_count = 0
+    if batch:
+        yield batch
+
+
+def split_size_groups(size_list, stages, buffer_size=BUFFER_SIZE,
+                      executor=None, cache=None, stats=None, deadline=None,
+                      unfinished=None, stopped=None):
+    """
+    Return the groups of duplicates inside groups of files with the same
+    size, using the checksum stages one after another.
+
+    @param size_list: A list of groups of FileRecord with the same size.
+
+    @param stages: The checksum stages returned by get_checksum_stages.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @param executor: The pool of workers hashing the files, None to hash
+    them one at a time.
+
+    @param cache: The HashCache storing the hashes of the files between
+    runs, None to hash every file.
+
+    @param stats: The ScanStats counting the files and the bytes read at
+    each stage, None to not count them.
+
+    @param deadline: The value of time.perf_counter after which no other
+    stage is started, None for no limit.
+
+    @param unfinished: The list the groups of size_list not finished
+    before the deadline or the stop are appended to, None to not keep
+    them.
+
+    @param stopped: The threading.Event after which no other stage is
+    started once it is set, None to never stop.
+
+    @return: A list of groups of FileRecord of duplicates, without the
+    groups not finished before the deadline or the stop.
+    """
+    groups = []
+    hash_lists = [[] for _ in size_list]
+    # Grouping all the groups by checksum at once, from the cheapest
+    # checksum to the checksum of the whole content
+    pending = list(enumerate(size_list))
+    previous_size = 0
+    for stage, get_checksum, compared_size in stages:
+        if deadline is not None and perf_counter() >= deadline or \
+                stopped is not None and stopped.is_set():
+            if unfinished is not None:
+                unfinished += [size_list[index] for index in
+                               sorted({index for index, _ in pending})]
+            break
+        if stats is not None:
+            stats.start(stage, compared_size - previous_size)
+        splits = split_groups_by_checksum(
+            [group for _, group in pending], buffer_size,
+            get_checksum, executor, cache, stage, stats)
+        if stats is not None:
+            stats.stop(stage, [group for _, group in pending],
+                       [group for split in splits for group in split])
+        previous_size = compared_size
+        next_pending = []
+        for (index, _), hash_list in zip(pending, splits):
+            # Stop when the blocks already compared cover the whole file
+            if compared_size >= size_list[index][0].size:
+                hash_lists[index] += hash_list
+            else:
+                next_pending += [(index, group) for group in hash_list]
+        pending = next_pending
+        if not pending:
+            break
+    # Keep the groups in the order of their first file
+    for group, hash_list in zip(size_list, hash_lists):
+        if len(hash_list) > 1:
+            positions = {record: index
+                         for index, record in enumerate(group)}
+            hash_list.sort(key=lambda files: positions[files[0]])
+        groups += hash_list
+
+    return groups
+
+
+# ---------------------------Incremental Scan----------------------
+class Snapshot:
+    """
+    State of a scanned tree kept in a SQLite database between two runs:
+    the directories with their modification time and sub-directories,
+    the files found in each directory and the groups of duplicates.
+
+    A directory whose modification time is unchanged is not read again and
+    its files are taken from the snapshot, so a file modified in place is
+    only noticed once its directory is modified.  The groups of duplicates
+    are only searched again for the sizes of the files added, removed or
+    modified since the snapshot, the other groups are kept as they are.
+    """
+
+    def __init__(self, path):
+        """
+        Load the snapshot, creating the database if it doesn't exist.
+
+        @param path: The path of the database file.
+        """
+        self.path = path
+        self.directories = {}
+        self.files = {}
+        self.previous_files = {}
+        self.groups = []
+        self.options = None
+        self.scan_filter = None
+        connection = self.connect()
+        row = connection.execute('SELECT value FROM snapshot_options '
+                                 "WHERE name = 'options'").fetchone()
+        self.options = row and loads(row[0])
+        row = connection.execute('SELECT value FROM snapshot_options '
+                                 "WHERE name = 'scan_filter'").fetchone()
+        self.scan_filter = row and loads(row[0])
+        for directory, mtime_ns, sub_directories in connection.execute(
+                'SELECT path, mtime_ns, sub_directories FROM directories'):
+            self.directories[directory] = (mtime_ns, loads(sub_directories))
+        for row in connection.execute(
+                'SELECT directory, path, size, inode, device, mtime_ns '
+                'FROM files ORDER BY rowid'):
+            self.files.setdefault(row[0], []).append(FileRecord(*row[1:]))
+        group_dict = {}
+        for group_id, path in connection.execute(
+                'SELECT group_id, path FROM duplicates ORDER BY rowid'):
+            group_dict.setdefault(group_id, []).append(path)
+        self.groups = list(group_dict.values())
+        connection.close()
+
+    def connect(self):
+        """
+        Return a connection to the database, creating its tables.
+
+        @return: A sqlite3.Connection.
+        """
+        connection = connect(self.path)
+        connection.execute('CREATE TABLE IF NOT EXISTS snapshot_options ('
+                           'name TEXT PRIMARY KEY, value TEXT)')
+        connection.execute('CREATE TABLE IF NOT EXISTS directories ('
+                           'path TEXT PRIMARY KEY, mtime_ns INTEGER, '
+                           'sub_directories TEXT)')
+        connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                           'directory TEXT, path TEXT, size INTEGER, '
+                           'inode INTEGER, device INTEGER, '
+                           'mtime_ns INTEGER)')
+        connection.execute('CREATE TABLE IF NOT EXISTS duplicates ('
+                           'group_id INTEGER, path TEXT)')
+
+        return connection
+
+    def scan(self, path, scan_filter=None, stats=None,
+             scanner=scan_directory):
+        """
+        Generate the records of all files inside all directory specify by
+        a path, in the same order as scan_file_records, only reading the
+        directories modified since the snapshot.
+
+        @param path: A path of a directory.
+
+        @param scan_filter: The ScanFilter of the files kept, None to keep
+        all the files.  Every directory is read again when the filter is
+        not the one of the snapshot.
+
+        @param stats: The ScanStats counting the directories read and the
+        directories and files taken from the snapshot, None to not count
+        them.
+
+        @param scanner: The function reading a directory, scan_directory
+        or a StatxScanner.
+
+        @return: a generator of FileRecord with absolute paths.
+        """
+        # The filter is compared as it is saved in the database
+        scan_filter_value = loads(dumps(scan_filter))
+        if scan_filter_value != self.scan_filter:
+            self.directories = {}
+        self.scan_filter = scan_filter_value
+        directories = {}
+        files = {}
+        pending = [abspath(path)]
+        while pending:
+            directory = pending.pop()
+            if stats is not None:
+                stats.start('scan')
+                stats.count('scan', stat_calls=1)
+            try:
+                mtime_ns = stat(directory).st_mtime_ns
+            except OSError:
+                if stats is not None:
+                    stats.stop('scan')
+                continue
+            known = self.directories.get(directory)
+            if known is not None and known[0] == mtime_ns:
+                records = self.files.get(directory, [])
+                sub_directories = known[1]
+                if stats is not None:
+                    stats.count('scan', directories_unchanged=1,
+                                files_unchanged=len(records))
+                    stats.stop('scan')
+            else:
+                records, sub_directories = scanner(directory, scan_filter,
+                                                   stats)
+                if stats is not None:
+                    stats.scanned(records)
+            directories[directory] = (mtime_ns, sub_directories)
+            files[directory] = records
+            yield from records
+            # Visit the sub-directories in their order, depth first
+            pending += reversed(sub_directories)
+        self.previous_files = self.files
+        self.directories = directories
+        self.files = files
+
+    def find_duplicates(self, records, options, find_duplicates):
+        """
+        Generate the groups of duplicates of the scanned files, keeping the
+        groups of the snapshot whose size has no file added, removed or
+        modified, and searching the groups of the other sizes again.
+
+        @param records: The list of FileRecord returned by scan.
+
+        @param options: A dictionary of the options of the search, the
+        groups of the snapshot are only kept if they were found with the
+        same options.
+
+        @param find_duplicates: The function generating the groups of
+        duplicates of a list of FileRecord.
+
+        @return: A generator of groups of FileRecord of duplicates.
+        """
+        groups = []
+        if options == self.options:
+            current = {record.path: record for record in records}
+            previous = {record.path: record
+                        for directory in self.previous_files.values()
+                        for record in directory}
+            # A modified file leaves its old size and joins its new size
+            changed_sizes = set()
+            for path, record in current.items():
+                if previous.get(path) != record:
+                    changed_sizes.add(record.size)
+                    if path in previous:
+                        changed_sizes.add(previous[path].size)
+            changed_sizes.update(record.size
+                                 for path, record in previous.items()
+                                 if path not in current)
+            for paths in self.groups:
+                group = [current.get(path) for path in paths]
+                if all(record is not None and
+                       record == previous.get(record.path) and
+                       record.size not in changed_sizes
+                       for record in group):
+                    groups.append(group)
+                    yield group
+            records = [record for record in records
+                       if record.size in changed_sizes]
+        for group in find_duplicates(records):
+            groups.append(group)
+            yield group
+        self.groups = [[record.path for record in group] for group in groups]
+        self.options = options
+
+    def save(self):
+        """
+        Replace the content of the database by the last scan and groups.
+        """
+        connection = self.connect()
+        for table in ('snapshot_options', 'directories', 'files',
+                      'duplicates'):
+            connection.execute('DELETE FROM %s' % table)
+        connection.execute('INSERT INTO snapshot_options VALUES (?, ?)',
+                           ('options', dumps(self.options)))
+        connection.execute('INSERT INTO snapshot_options VALUES (?, ?)',
+                           ('scan_filter', dumps(self.scan_filter)))
+        connection.executemany(
+            'INSERT INTO directories VALUES (?, ?, ?)',
+            ((directory, mtime_ns, dumps(sub_directories))
+             for directory, (mtime_ns, sub_directories)
+             in self.directories.items()))
+        connection.executemany(
+            'INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)',
+            ((directory,) + record
+             for directory, records in self.files.items()
+             for record in records))
+        connection.executemany(
+            'INSERT INTO duplicates VALUES (?, ?)',
+            ((group_id, path) for group_id, paths in enumerate(self.groups)
+             for path in paths))
+        connection.commit()
+        connection.close()
+
+
+# ---------------------------Resumable Scan------------------------
+class Checkpoint:
+    """
+    Progress of the scan of a run saved in a SQLite database at regular
+    intervals, so a run which is stopped can be resumed where it stopped.
+
+    The files found and the directories left to read are saved together,
+    at most once every interval, so the scan is resumed from the last
+    save without missing or repeating a directory.  The hashes of the
+    files are saved by a HashCache with a checkpoint interval, usually in
+    the same database.
+    """
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        """
+        Open the checkpoint, creating the database if it doesn't exist.
+
+        @param path: The path of the database file.
+
+        @param interval: The minimum number of seconds between two saves.
+        """
+        self.interval = interval
+        self.saved = time()
+        self.connection = connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoint_state ('
+            'name TEXT PRIMARY KEY, value TEXT)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoint_files ('
+            'path TEXT, size INTEGER, inode INTEGER, device INTEGER, '
+            'mtime_ns INTEGER)')
+        self.connection.commit()
+
+    def scan(self, path, resume=False, scan_filter=None, stats=None,
+             scanner=scan_directory):
+        """
+        Generate the records of all files inside all directory specify by
+        a path, in the same order as scan_file_records, saving the progress
+        of the scan.
+
+        @param path: A path of a directory.
+
+        @param resume: True to continue the scan saved for the same path
+        and filter, False to start a new scan.
+
+        @param scan_filter: The ScanFilter of the files kept, None to keep
+        all the files.
+
+        @param stats: The ScanStats counting the directories read and the
+        files taken from the checkpoint, None to not count them.
+
+        @param scanner: The function reading a directory, scan_directory
+        or a StatxScanner.
+
+        @return: a generator of FileRecord with absolute paths.
+        """
+        path = abspath(path)
+        state = dict(self.connection.execute(
+            'SELECT name, value FROM checkpoint_state'))
+        if resume and state.get('path') == path and \
+                state.get('scan_filter') == dumps(scan_filter):
+            directories = loads(state['directories'])
+            resumed = [FileRecord(*row) for row in self.connection.execute(
+                'SELECT * FROM checkpoint_files ORDER BY rowid')]
+            if stats is not None:
+                stats.count('scan', files_resumed=len(resumed))
+            yield from resumed
+        else:
+            directories = [path]
+            self.connection.execute('DELETE FROM checkpoint_files')
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO checkpoint_state VALUES (?, ?)',
+                [('path', path), ('scan_filter', dumps(scan_filter))])
+            self.save(directories, [])
+        scanned = []
+        while directories:
+            if stats is not None:
+                stats.start('scan')
+            records, sub_directories = scanner(directories.pop(),
+                                               scan_filter, stats)
+            if stats is not None:
+                stats.scanned(records)
+            # Visit the sub-directories in their order, depth first
+            directories += reversed(sub_directories)
+            scanned += records
+            if time() - self.saved >= self.interval:
+                self.save(directories, scanned)
+                scanned = []
+            yield from records
+        self.save(directories, scanned)
+
+    def save(self, directories, records):
+        """
+        Save the directories left to read and the files found since the
+        previous save.
+
+        @param directories: The list of the directories left to read.
+
+        @param records: The list of FileRecord found since the previous
+        save.
+        """
+        self.connection.executemany(
+            'INSERT INTO checkpoint_files VALUES (?, ?, ?, ?, ?)', records)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO checkpoint_state VALUES (?, ?)',
+            ('directories', dumps(directories)))
+        self.connection.commit()
+        self.saved = time()
+
+    def close(self):
+        """
+        Close the database.
+        """
+        self.connection.close()
+
+
+# ---------------------------Content Index-------------------------
+class ContentIndex:
+    """
+    Files, groups of duplicates and hashes of the last run kept in a
+    SQLite database, so they can be queried without scanning again.
+
+    The files are indexed by path and the groups by the bytes they waste,
+    so a query only reads the rows it returns: the duplicates of a file,
+    the groups wasting the most space, or the groups with a file inside
+    a directory, whose files are a range of paths.
+    """
+
+    def __init__(self, path):
+        """
+        Open the index, creating the database if it doesn't exist.
+
+        @param path: The path of the database file.
+        """
+        self.connection = connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS index_state ('
+            'name TEXT PRIMARY KEY, value TEXT)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS index_files ('
+            'path TEXT PRIMARY KEY, size INTEGER, inode INTEGER, '
+            'device INTEGER, mtime_ns INTEGER, group_id INTEGER)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS index_groups ('
+            'group_id INTEGER PRIMARY KEY, size INTEGER, count INTEGER, '
+            'wasted INTEGER, digest TEXT)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS index_files_group '
+            'ON index_files (group_id)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS index_groups_wasted '
+            'ON index_groups (wasted)')
+        self.connection.commit()
+
+    def save(self, path, records, groups, digests=()):
+        """
+        Replace the content of the index by the files and the groups of
+        duplicates of a run.
+
+        @param path: The path of the directory scanned.
+
+        @param records: An iterable of the FileRecord of the files scanned.
+
+        @param groups: A list of groups of FileRecord of duplicates.
+
+        @param digests: The hashes of the content of the groups, in the
+        same order as the groups, empty if they are not known.
+        """
+        group_dict = {}
+        rows = []
+        for group_id, group in enumerate(groups):
+            rows.append((group_id, group[0].size, len(group),
+                         get_reclaimable_size(group),
+                         digests[group_id] if digests else None))
+            for record in group:
+                group_dict[record.path] = group_id
+        for table in ('index_state', 'index_files', 'index_groups'):
+            self.connection.execute('DELETE FROM %s' % table)
+        self.connection.executemany(
+            'INSERT INTO index_state VALUES (?, ?)',
+            [('path', abspath(path)), ('time', str(int(time())))])
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO index_files VALUES (?, ?, ?, ?, ?, ?)',
+            (record + (group_dict.get(record.path),) for record in records))
+        self.connection.executemany(
+            'INSERT INTO index_groups VALUES (?, ?, ?, ?, ?)', rows)
+        self.connection.commit()
+
+    def get_group(self, group_id):
+        """
+        Return a group of duplicates of the index.
+
+        @param group_id: The identifier of the group.
+
+        @return: An IndexedGroup with its paths sorted.
+        """
+        size, wasted, digest = self.connection.execute(
+            'SELECT size, wasted, digest FROM index_groups '
+            'WHERE group_id = ?', (group_id,)).fetchone()
+        paths = [path for path, in self.connection.execute(
+            'SELECT path FROM index_files WHERE group_id = ? '
+            'ORDER BY path', (group_id,))]
+
+        return IndexedGroup(size, wasted, digest, paths)
+
+    def get_duplicates(self, path):
+        """
+        Return the duplicates of a file.
+
+        @param path: A path of the file.
+
+        @return: The sorted list of the paths of the other files of its
+        group, empty if it has no duplicate, or None if the file was not
+        scanned.
+        """
+        path = abspath(path)
+        row = self.connection.execute(
+            'SELECT group_id FROM index_files WHERE path = ?',
+            (path,)).fetchone()
+        if row is None:
+            return None
+        if row[0] is None:
+            return []
+
+        return [other for other in self.get_group(row[0]).paths
+                if other != path]
+
+    def get_top_groups(self, limit=10):
+        """
+        Return the groups of duplicates wasting the most space.
+
+        @param limit: The maximum number of groups returned.
+
+        @return: A list of IndexedGroup, the largest waste first.
+        """
+        return [self.get_group(group_id) for group_id, in
+                self.connection.execute(
+                    'SELECT group_id FROM index_groups '
+                    'ORDER BY wasted DESC, group_id LIMIT ?', (limit,))]
+
+    def get_directory_groups(self, directory):
+        """
+        Return the groups of duplicates with a file inside a directory or
+        its sub-directories, with all their files.
+
+        @param directory: A path of the directory.
+
+        @return: A list of IndexedGroup, the largest waste first.
+        """
+        prefix = join(abspath(directory), '')
+        # The paths inside the directory are the paths between the prefix
+        # and the prefix ending with the character following the separator
+        end = prefix[:-1] + chr(ord(sep) + 1)
+        groups = [self.get_group(group_id) for group_id, in
+                  self.connection.execute(
+                      'SELECT DISTINCT group_id FROM index_files '
+                      'WHERE path >= ? AND path < ? '
+                      'AND group_id IS NOT NULL', (prefix, end))]
+
+        return sorted(groups, key=lambda group: -group.wasted)
+
+    def close(self):
+        """
+        Close the database.
+        """
+        self.connection.close()
+
+
+def iter_collected(items, collected):
+    """
+    Generate the items of an iterable, appending them to a list.
+
+    @param items: An iterable.
+
+    @param collected: The list the items are appended to.
+
+    @return: A generator of the items.
+    """
+    for item in items:
+        collected.append(item)
+        yield item
+
+
+def get_group_digests(groups, cache=None, algorithm=HASH_ALGORITHM,
+                      mmap_threshold=MMAP_THRESHOLD):
+    """
+    Return the hash of the content of each group of duplicates.
+
+    The hash of a group is the hash of its first file by the last checksum
+    stage, taken from the cache when the group has been hashed entirely,
+    so only the files small enough to be compared by their blocks are
+    read again.
+
+    @param groups: A list of groups of FileRecord of duplicates.
+
+    @param cache: The HashCache of the run, None to hash the first file
+    of each group.
+
+    @param algorithm: The name of the hash function in HASH_ALGORITHMS.
+
+    @param mmap_threshold: The minimum size in bytes of the files mapped
+    in memory to be hashed, 0 to never map them.
+
+    @return: A list of hashes in the same order as the groups, None for
+    the groups which can't be read.
+    """
+    digests = get_cached_checksums(
+        [group[0] for group in groups],
+        get_checksum=partial(get_file_checksum, algorithm=algorithm,
+                             mmap_threshold=mmap_threshold),
+        cache=cache, stage='%s:full' % algorithm)
+
+    return [digest or None for digest in digests]
+
+
+# ---------------------------Asynchronous API----------------------
+async def find_duplicates_async(path, executor=None, queue_size=QUEUE_SIZE,
+                                **options):
+    """
+    Generate the groups of duplicates of a directory without blocking the
+    event loop.
+
+    The directory is scanned and its files are hashed by a task of the
+    executor, which sends each group of duplicates to the event loop as
+    soon as it is found.  The task pauses while queue_size groups are
+    waiting to be consumed, and stops before the next file scanned or the
+    next checksum stage when the generator is closed or the consumer is
+    cancelled.
+
+    @param path: A path of a directory.
+
+    @param executor: The executor running the blocking scan, None to use
+    the default executor of the event loop.  Its number of workers bounds
+    the number of scans running at the same time.
+
+    @param queue_size: The maximum number of groups waiting to be
+    consumed.
+
+    @param options: The keyword arguments given to iter_duplicate_records,
+    except stopped.
+
+    @return: An asynchronous generator of groups of FileRecord of
+    duplicates.
+    """
+    loop = get_running_loop()
+    queue = Queue(queue_size)
+    stopped = Event()
+
+    def put(item):
+        # Block the scan until the consumer has room for the item
+        run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def scan_records():
+        for record in scan_file_records(path):
+            if stopped.is_set():
+                return
+            yield record
+
+    def scan():
+        groups = iter_duplicate_records(scan_records(), stopped=stopped,
+                                        **options)
+        try:
+            for group in groups:
+                if stopped.is_set():
+                    return
+                put((group, None))
+        except Exception as error:
+            if not stopped.is_set():
+                put((None, error))
+        else:
+            if not stopped.is_set():
+                put((None, None))
+        finally:
+            groups.close()
+
+    task = loop.run_in_executor(executor, scan)
+    try:
+        while True:
+            group, error = await queue.get()
+            if error is not None:
+                raise error
+            if group is None:
+                break
+            yield group
+        await task
+    finally:
+        stopped.set()
+        # Free the queue so a scan waiting for room can see it's stopped
+        while not queue.empty():
+            queue.get_nowait()
+
+
+# ---------------------------Print Results-------------------------
+def get_group_data(group, reclaimable=False):
+    """
+    Return a group of duplicates as it is printed in JSON.
+
+    @param group: A group of FileRecord.
+
+    @param reclaimable: True to add the bytes freed by keeping a single
+    copy of the group to its paths.
+
+    @return: The list of the paths of the group, or a dictionary of the
+    bytes freed and the paths.
+    """
+    paths = [record.path for record in group]
+    if reclaimable:
+        return {'reclaimable': get_reclaimable_size(group), 'paths': paths}
+
+    return paths
+
+
+def print_groups(groups, ndjson=False, reclaimable=False):
+    """
+    Print the paths of the groups of duplicates in JSON.
+
+    @param groups: An iterable of groups of FileRecord.
+
+    @param ndjson: True to print each group on its own line as soon as
+    it is generated, False to print a single list of groups.
+
+    @param reclaimable: True to print each group as an object with the
+    bytes freed by keeping a single copy and the paths.
+    """
+    data = (get_group_data(group, reclaimable) for group in groups)
+    if ndjson:
+        # Print out each group as a JSON line once it is found
+        for group in data:
+            print(dumps(group), flush=True)
+    else:
+        # Print out to JSON formatted string
+        print(dumps(list(data)))
+
+
+def print_separate_groups(groups, ndjson=False, reclaimable=False):
+    """
+    Print the paths of the groups of duplicates and of the groups of paths
+    linked to the same file in JSON, in separate sections.
+
+    @param groups: An iterable of groups of FileRecord.
+
+    @param ndjson: True to print each group on its own line as soon as
+    it is generated, False to print a single object with the lists of
+    groups.
+
+    @param reclaimable: True to print each group as an object with the
+    bytes freed by keeping a single copy and the paths.
+    """
+    data = {'duplicates': [], 'linked': []}
+    for group in groups:
+        section = 'linked' if is_linked_group(group) else 'duplicates'
+        paths = get_group_data(group, reclaimable)
+        if ndjson:
+            print(dumps({section: paths}), flush=True)
+        else:
+            data[section].append(paths)
+    if not ndjson:
+        print(dumps(data))
+
+
+# ---------------------------Main Function-------------------------
+def find_and_print_duplicates(args, stats=None):
+    """
+    Find the duplicates of the directory inputted by the user and print
+    them in JSON.
+
+    @param args: The argparse Namespace returned by get_argument.
+
+    @param stats: The ScanStats counting the work done at each stage,
+    None to not count it.
+    """
+    path = args.path
+    # Only the files kept by the filter are stat'ed and kept in memory
+    scan_filter = create_scan_filter(
+        args.include, args.exclude,
+        args.extensions and args.extensions.split(','), args.min_size,
+        args.max_size, args.prune)
+    # Get the files inside the directory specified by the path
+    snapshot = None
+    checkpoint = None
+    scanner = get_scanner(args.scanner)
+    if args.watch:
+        # The watched tree is scanned while its directories are
+        # being watched
+        records = None
+    elif args.incremental:
+        snapshot = Snapshot(args.incremental)
+        records = list(snapshot.scan(path, scan_filter, stats, scanner))
+    elif args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint, args.checkpoint_interval)
+        records = checkpoint.scan(path, args.resume, scan_filter, stats,
+                                  scanner)
+    else:
+        records = scan_file_records(path, args.scan_jobs, stats,
+                                    scan_filter, scanner)
+    # Return a list of groups of duplicate files, the hashes of an
+    # incremental or resumable scan are kept with its state by default
+    cache = None
+    cache_path = args.cache or args.incremental or args.checkpoint or \
+        args.index
+    if cache_path:
+        cache = HashCache(cache_path, args.cache_size,
+                          args.checkpoint_interval if args.checkpoint
+                          else None)
+    try:
+        # A search stopped by a budget hashes the largest wins first
+        priority = args.priority or args.time_budget is not None or \
+            args.byte_budget is not None
+        algorithm = args.hash
+        if algorithm == 'auto':
+            algorithm = get_fastest_algorithm()
+        find_duplicates = partial(
+            iter_duplicate_records, buffer_size=args.buffer_size,
+            head_size=args.head_size, tail_size=args.tail_size,
+            jobs=args.jobs, processes=args.processes, cache=cache,
+            batch_size=args.batch_size,
+            merge_links=not args.separate_links, algorithm=algorithm,
+            verify=args.verify, mmap_threshold=args.mmap_threshold,
+            stats=stats, priority=priority, time_budget=args.time_budget,
+            byte_budget=args.byte_budget)
+        if args.watch:
+            # Imported only when needed, inotify is Linux only
+            from watch_duplicate_files import watch_duplicate_files
+            try:
+                watch_duplicate_files(path, find_duplicates,
+                                      scan_filter=scan_filter, stats=stats)
+            except KeyboardInterrupt:
+                pass
+            return
+        if args.index:
+            # Keep the files scanned and the groups printed to index them
+            records = list(records)
+            indexed = []
+        if snapshot is None:
+            groups = find_duplicates(records)
+        else:
+            options = {'hash': algorithm, 'verify': args.verify,
+                       'head_size': args.head_size,
+                       'tail_size': args.tail_size,
+                       'separate_links': args.separate_links}
+            groups = snapshot.find_duplicates(records, options,
+                                              find_duplicates)
+        if args.index:
+            groups = iter_collected(groups, indexed)
+        if args.separate_links:
+            print_separate_groups(groups, args.ndjson, args.reclaimable)
+        else:
+            print_groups(groups, args.ndjson, args.reclaimable)
+        if args.index:
+            digests = get_group_digests(indexed, cache, algorithm,
+                                        args.mmap_threshold)
+    finally:
+        if cache is not None:
+            cache.close()
+        if checkpoint is not None:
+            checkpoint.close()
+    if snapshot is not None:
+        snapshot.save()
+    # The index is saved once the hashes of the cache are, which may be
+    # kept in the same database
+    if args.index:
+        content_index = ContentIndex(args.index)
+        try:
+            content_index.save(path, records, indexed, digests)
+        finally:
+            content_index.close()
 
 
-# ---------------------------Main Function-------------------------
 def main():
     """
     Entry point of the script.
     Convert the result into JSON formatted string.
     """
     try:
-        path = get_argument()
+        args = get_argument()
+        path = args.path
         # Error handling when the path don't exists or is a file
         if not exists(path) or isfile(path):
             print("Invalid path")
             exit(1)
         else:
-            # Get the list of files inside the directory specified by the path
-            file_path_names = scan_files(path)
-            # Return a list of groups of duplicate files
-            data = find_duplicate_files(file_path_names)
-            # Print out to JSON formatted string
-            print(dumps(data))
+            stats = None
+            if args.stats or args.trace_memory:
+                stats = ScanStats()
+                stats.start('total')
+            if args.trace_memory:
+                tracemalloc.start()
+            profiler = None
+            if args.profile:
+                profiler = Profile()
+                profiler.enable()
+            error = None
+            try:
+                find_and_print_duplicates(args, stats)
+            except Exception as exception:
+                error = exception
+                raise
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    profiler.dump_stats(args.profile)
+                # Report the work done on stderr, even if the run failed
+                if stats is not None:
+                    stats.stop('total')
+                    report = stats.report()
+                    if args.trace_memory:
+                        report['memory'] = get_memory_report()
+                    if error is not None:
+                        report['error'] = repr(error)
+                    print(dumps(report), file=stderr)
     except Exception:
         print("Check the directory or the input again!")
         exit(1)
@@ -18,7 +18,9 @@
 # SOFTWARE OR ITS DERIVATIVES.
 
 import argparse
+import concurrent.futures
 import errno
+import fcntl
 import io
 import json
 import os
@@ -45,6 +47,18 @@ FILE_MIN_SIZE = ONE_KB
 # Default maximum size of a file to randomly generate.
 FILE_MAX_SIZE = ONE_GB
 
+# Size of the blocks of random bytes written at once into a file.
+GENERATION_BLOCK_SIZE = ONE_MB
+
+# Ways a duplicate file can be created from its source file: a copy of
+# its content, a hard link to the same inode, or a reflink sharing the
+# blocks of the source file until one of them is modified.
+DUPLICATE_MODES = ('copy', 'hardlink', 'reflink')
+
+# Request code of the ioctl cloning the content of a file into another
+# one on Linux file systems supporting reflinks (Btrfs, XFS, ...).
+FICLONE = 0x40049409
+
 
 def build_tree_pathname(file_name, directory_depth=8, pathname_separator_character=os.sep):
     """
@@ -80,18 +94,42 @@ def build_tree_pathname(file_name, directory_depth=8, pathname_separator_charact
         for i in range(min(directory_depth, len(filename_without_extension)))])
 
 
-def duplicate_file(source_file_path_name, destination_file_path_name):
+def duplicate_file(source_file_path_name, destination_file_path_name, duplicate_mode='copy'):
     """
     Duplicate a source file to another path.
 
 
+    @note: a reflink falls back to a copy when the file system doesn't
+        support it.
+
+
     @param source_file_path_name: absolute path and name of a file to
         duplicate (copy).
 
     @param destination_file_path_name: absolute path and name of the
         destination of this source file.
+
+    @param duplicate_mode: one of ``DUPLICATE_MODES``, how the duplicate
+        is created.
     """
-    shutil.copyfile(source_file_path_name, destination_file_path_name)
+    if os.path.abspath(source_file_path_name) == os.path.abspath(destination_file_path_name):
+        return
+
+    if duplicate_mode == 'hardlink':
+        if os.path.lexists(destination_file_path_name):
+            os.remove(destination_file_path_name)
+        os.link(source_file_path_name, destination_file_path_name)
+
+    elif duplicate_mode == 'reflink':
+        try:
+            with io.open(source_file_path_name, mode='rb') as source_fd, \
+                    io.open(destination_file_path_name, mode='wb') as destination_fd:
+                fcntl.ioctl(destination_fd.fileno(), FICLONE, source_fd.fileno())
+        except OSError:
+            shutil.copyfile(source_file_path_name, destination_file_path_name)
+
+    else:
+        shutil.copyfile(source_file_path_name, destination_file_path_name)
 
 
 def generate_files(file_count,
@@ -106,7 +144,11 @@ def generate_files(file_count,
         file_name_min_length=1,
         file_min_size=FILE_MIN_SIZE,
         file_max_size=FILE_MAX_SIZE,
-        root_path=None):
+        root_path=None,
+        seed=None,
+        sparse=False,
+        duplicate_mode='copy',
+        workers=1):
     """
     Generate random files with a certain ratio of duplicate files.
 
@@ -145,13 +187,33 @@ def generate_files(file_count,
 
     @param root_path: absolute root path where to generate files.
 
+    @param seed: seed of the random generator, so that the same tree of
+        files is generated each time with the same seed.  If not defined,
+        the generator is not reseeded.
+
+    @param sparse: indicate whether to only write the first block of
+        each file, leaving the rest of the file as a hole.
+
+    @param duplicate_mode: one of ``DUPLICATE_MODES``, how the duplicate
+        files are created.
+
+    @param workers: number of processes writing the content of the
+        files at the same time.
+
 
     @return: the list of `(file_path_name, file_size)` of files that have
         been generated.
     """
+    if seed is not None:
+        random.seed(seed)
+
     file_path_name_sizes = []
     duplicate_file_path_names = []
+    random_file_arguments = []
 
+    # Draw all the paths, sizes and contents first, so that the same
+    # files are generated with the same seed whatever the number of
+    # workers writing them.
     for i in range(file_count):
         path = os.path.join(root_path if root_path else '.', generate_random_path(
             directory_max_depth=directory_max_depth,
@@ -169,22 +231,35 @@ def generate_files(file_count,
         file_path_name = os.path.join(path, file_name)
 
         if len(file_path_name_sizes) * duplicate_file_ratio > len(duplicate_file_path_names):
-            duplicate_file(file_path_name_sizes[random.randint(0, len(file_path_name_sizes) - 1)][0], file_path_name)
-            duplicate_file_path_names.append(file_path_name)
+            (source_file_path_name, file_size) = file_path_name_sizes[random.randint(0, len(file_path_name_sizes) - 1)]
+            duplicate_file_path_names.append((source_file_path_name, file_path_name))
 
         else:
-            file_size = generate_random_file(file_path_name,
-                file_min_size=file_min_size,
-                file_max_size=file_max_size)
+            file_size = random.randint(file_min_size, file_max_size)
+            # Without seed, the content is read from the operating system.
+            file_seed = random.getrandbits(64) if seed is not None else None
+            random_file_arguments.append((file_path_name, file_size, file_seed, sparse))
 
         file_path_name_sizes.append((file_path_name, file_size))
 
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            list(executor.map(write_random_file_arguments, random_file_arguments, chunksize=16))
+    else:
+        for arguments in random_file_arguments:
+            write_random_file_arguments(arguments)
+
+    # The duplicates are created once their source files are written.
+    for (source_file_path_name, file_path_name) in duplicate_file_path_names:
+        duplicate_file(source_file_path_name, file_path_name, duplicate_mode=duplicate_mode)
+
     return file_path_name_sizes
 
 
 def generate_random_file(file_path_name,
         file_min_size=FILE_MIN_SIZE,
-        file_max_size=FILE_MAX_SIZE):
+        file_max_size=FILE_MAX_SIZE,
+        sparse=False):
     """
     Create a binary file of a random size of bytes.
 
@@ -197,32 +272,77 @@ def generate_random_file(file_path_name,
     @param file_max_size: maximum size in bytes of the file to randomly
         generate.
 
+    @param sparse: indicate whether to only write the first block of the
+        file, leaving the rest of the file as a hole.
+
 
     @return: the size of the file that has been created.
     """
     # Choose a random size for this file.
     file_required_size = random.randint(file_min_size, file_max_size)
-    file_current_size = 0
 
-    # Preferred file system block size.
-    preferred_block_size = os.statvfs('/').f_bsize
+    write_random_file(file_path_name, file_required_size, sparse=sparse)
 
-    # Reduce the size of the block if the chosen size of the file to be
-    # generated is below.
-    block_size = min(file_required_size, preferred_block_size)
+    return file_required_size
+
+
+def write_random_file(file_path_name, file_size, seed=None, sparse=False):
+    """
+    Create a binary file of random bytes.
+
+
+    @note: the blocks are written from a single buffer reused for every
+        block, filled from the random generator of the operating system
+        without seed.
+
+
+    @param file_path_name: absolute path name of the file to be created.
+
+    @param file_size: size in bytes of the file.
+
+    @param seed: seed of the random generator of the bytes, so that the
+        same content is written each time with the same seed.
+
+    @param sparse: indicate whether to only write the first block of the
+        file, leaving the rest of the file as a hole.
+    """
+    block_size = min(file_size, GENERATION_BLOCK_SIZE)
+    data_size = block_size if sparse else file_size
+    file_current_size = 0
+
+    buffer = memoryview(bytearray(block_size))
 
-    # Create the file with random binary blocks up to the chosen size of
-    # this file.
     with io.open(file_path_name, mode='wb') as fd:
-        while block_size:
-            fd.write(bytes([random.randint(0, 255) for i in range(block_size)]))
+        if seed is None:
+            with io.open('/dev/urandom', mode='rb', buffering=0) as random_fd:
+                while file_current_size < data_size:
+                    length = min(block_size, data_size - file_current_size)
+                    random_fd.readinto(buffer[:length])
+                    fd.write(buffer[:length])
+                    file_current_size += length
 
-            file_current_size += block_size
+        else:
+            generator = random.Random(seed)
+            while file_current_size < data_size:
+                length = min(block_size, data_size - file_current_size)
+                buffer[:length] = generator.getrandbits(length * 8).to_bytes(length, 'little')
+                fd.write(buffer[:length])
+                file_current_size += length
 
-            if file_current_size + block_size > file_required_size:
-                block_size = file_required_size - file_current_size
+        # Extend the file up to its size without writing the remaining
+        # blocks, so that the file system doesn't allocate them.
+        fd.truncate(file_size)
 
-    return file_required_size
+
+def write_random_file_arguments(arguments):
+    """
+    Create a binary file of random bytes from a tuple of the arguments of
+    ``write_random_file``, to be called by a pool of processes.
+
+
+    @param arguments: a tuple `(file_path_name, file_size, seed, sparse)`.
+    """
+    write_random_file(*arguments)
 
 
 def generate_random_file_name(
@@ -318,7 +438,11 @@ def main():
         file_name_min_length=arguments.file_name_min_length,
         file_min_size=arguments.file_min_size,
         file_max_size=arguments.file_max_size,
-        root_path=arguments.root_path)))
+        root_path=arguments.root_path,
+        seed=arguments.seed,
+        sparse=arguments.sparse,
+        duplicate_mode=arguments.duplicate_mode,
+        workers=arguments.workers)))
 
 
 def make_directory_if_not_exists(path):
@@ -387,6 +511,16 @@ def parse_arguments():
     parser.add_argument('--file-max-size', type=int, required=False, default=FILE_MAX_SIZE,
         help='specify the maximum size of a file to randomly generate')
 
+    parser.add_argument('--seed', type=int, required=False,
+        help='specify the seed of the random generator to generate the same files each time')
+
+    parser.add_argument('--sparse', action='store_true',
+        help='specify to only write the first block of each file, leaving the rest of the file as a hole')
+    parser.add_argument('--duplicate-mode', choices=DUPLICATE_MODES, required=False, default='copy',
+        help='specify how the duplicate files are created from their source file')
+    parser.add_argument('--workers', type=int, required=False, default=1,
+        help='specify the number of processes writing the files at the same time')
+
     return parser.parse_args()
 
 
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+from find_duplicate_files import ContentIndex
+from argparse import ArgumentParser
+from os.path import exists
+from json import dumps
+
+
+# Default number of groups returned by the top query.
+TOP_LIMIT = 10
+
+
+# ---------------------Get Argument From User----------------------
+def get_argument():
+    """
+    Return the arguments inputted by the user through the command line.
+
+    @return: an argparse Namespace of the arguments.
+    """
+    parser = ArgumentParser(prog="Duplicate Files Index")
+    parser.add_argument('-i', '--index', type=str, required=True,
+                        metavar="path",
+                        help="content index saved by find_duplicate_files.py "
+                             "with --index")
+    queries = parser.add_subparsers(dest='query', required=True)
+    duplicate = queries.add_parser(
+        'duplicate', help="print the duplicates of a file")
+    duplicate.add_argument('file', type=str)
+    top = queries.add_parser(
+        'top', help="print the groups of duplicates wasting the most space")
+    top.add_argument('-n', '--limit', type=int, default=TOP_LIMIT,
+                     metavar="N")
+    under = queries.add_parser(
+        'under', help="print the groups of duplicates with a file inside a "
+                      "directory")
+    under.add_argument('directory', type=str)
+    args = parser.parse_args()
+
+    return args
+
+
+# ---------------------------Main Function-------------------------
+def main():
+    """
+    Entry point of the script.
+    Print the result of the query in JSON.
+    """
+    args = get_argument()
+    # Don't create an empty index when the path is wrong
+    if not exists(args.index):
+        print("Invalid index")
+        exit(1)
+    content_index = ContentIndex(args.index)
+    try:
+        if args.query == 'duplicate':
+            data = content_index.get_duplicates(args.file)
+        elif args.query == 'top':
+            data = [group._asdict()
+                    for group in content_index.get_top_groups(args.limit)]
+        else:
+            data = [group._asdict() for group in
+                    content_index.get_directory_groups(args.directory)]
+    finally:
+        content_index.close()
+    print(dumps(data))
+
+
+if __name__ == "__main__":
+    main()
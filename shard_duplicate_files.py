@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+from find_duplicate_files import get_file_checksum, iter_duplicate_records
+from find_duplicate_files import scan_file_records, create_executor
+from find_duplicate_files import HASH_ALGORITHMS, HASH_ALGORITHM
+from find_duplicate_files import BUFFER_SIZE, get_checksums
+from argparse import ArgumentParser, ArgumentTypeError
+from functools import partial
+from json import dumps, load
+
+
+# ---------------------Get Argument From User----------------------
+def parse_shard(value):
+    """
+    Convert a shard given as 'index/count' on the command line.
+
+    @param value: The string inputted by the user.
+
+    @return: A tuple of the index of the shard and the number of shards.
+
+    @raise ArgumentTypeError: if the shard is not valid.
+    """
+    try:
+        index, count = map(int, value.split('/'))
+    except ValueError:
+        raise ArgumentTypeError("expected index/count, got %r" % value)
+    if not 0 <= index < count:
+        raise ArgumentTypeError("the index must be between 0 and count - 1")
+
+    return index, count
+
+
+def get_argument():
+    """
+    Return the arguments inputted by the user through the command line.
+
+    @return: an argparse Namespace of the arguments.
+    """
+    parser = ArgumentParser(prog="Duplicate Files Finder Shards")
+    commands = parser.add_subparsers(dest='command', required=True)
+    sizes = commands.add_parser(
+        'sizes', help="write the histogram of the sizes of a shard")
+    digests = commands.add_parser(
+        'digests', help="write the partial result of a shard")
+    for command in (sizes, digests):
+        command.add_argument('-p', '--path', type=str, action='append',
+                             required=True, metavar="path",
+                             help="directory of the shard, can be repeated")
+        command.add_argument('--shard', type=parse_shard, metavar="i/n",
+                             help="only keep the files whose size belongs "
+                                  "to the shard i of n")
+        command.add_argument('-o', '--output', type=str, required=True,
+                             metavar="path")
+    digests.add_argument('--sizes', type=str, metavar="path",
+                         help="merged histogram of the sizes of all the "
+                              "shards, the files of the shard are compared "
+                              "alone if not given")
+    digests.add_argument('--hash', type=str, default=HASH_ALGORITHM,
+                         choices=sorted(HASH_ALGORITHMS))
+    digests.add_argument('-j', '--jobs', type=int, default=1, metavar="N")
+    merge_sizes = commands.add_parser(
+        'merge-sizes', help="merge the histograms of the sizes of shards")
+    merge_sizes.add_argument('histograms', nargs='+', metavar="path")
+    merge_sizes.add_argument('-o', '--output', type=str, required=True,
+                             metavar="path")
+    merge = commands.add_parser(
+        'merge', help="print the groups of duplicates of all the shards")
+    merge.add_argument('partials', nargs='+', metavar="path")
+    args = parser.parse_args()
+
+    return args
+
+
+# ---------------------Scanning a Shard----------------------------
+def scan_shard(paths, shard=None):
+    """
+    Generate the records of the files of a shard.
+
+    A shard is either a set of directories, or the files of a set of
+    directories whose size belongs to the shard, so all the files of a
+    same size are in the same shard.
+
+    @param paths: The list of the directories of the shard.
+
+    @param shard: A tuple of the index of the shard and the number of
+    shards, None to keep all the files.
+
+    @return: a generator of FileRecord with absolute paths.
+    """
+    for path in paths:
+        for record in scan_file_records(path):
+            if shard is None or record.size % shard[1] == shard[0]:
+                yield record
+
+
+def get_size_histogram(records):
+    """
+    Return the number of files of each size, except the empty ones.
+
+    @param records: An iterable of FileRecord.
+
+    @return: A dictionary with key is the size and value is the number
+    of files with that size.
+    """
+    histogram = {}
+    for record in records:
+        if record.size > 0:
+            histogram[record.size] = histogram.get(record.size, 0) + 1
+
+    return histogram
+
+
+def merge_size_histograms(histograms):
+    """
+    Return the number of files of each size in all the shards, for the
+    sizes of more than one file.
+
+    @param histograms: The histograms of the sizes of the shards.
+
+    @return: A dictionary with key is the size and value is the number
+    of files with that size.
+    """
+    merged = {}
+    for histogram in histograms:
+        for size, count in histogram.items():
+            merged[size] = merged.get(size, 0) + count
+
+    return {size: count for size, count in merged.items() if count > 1}
+
+
+# ---------------------Partial Result of a Shard-------------------
+def find_shard_partial(records, sizes=None, algorithm=HASH_ALGORITHM,
+                       jobs=1, buffer_size=BUFFER_SIZE):
+    """
+    Return the partial result of a shard.
+
+    The files whose size only appears in this shard are compared in the
+    shard, and their groups of duplicates are final.  The files whose
+    size also appears in other shards are hashed entirely, and their
+    digests are merged with the digests of the other shards.  The files
+    whose size appears only once in all the shards are not read.
+
+    @param records: A list of FileRecord of the shard.
+
+    @param sizes: The merged histogram of the sizes of all the shards,
+    None if the files of the shard can only be duplicates of each other.
+
+    @param algorithm: The name of the hash function in HASH_ALGORITHMS.
+
+    @param jobs: The number of files hashed at the same time.
+
+    @param buffer_size: The size in bytes of the chunks read from the files.
+
+    @return: A dictionary of the hash function, the groups of duplicates
+    found in the shard and the list of [path, size, digest] of the files
+    shared with other shards.
+    """
+    histogram = get_size_histogram(records)
+    local_records = []
+    shared_records = []
+    for record in records:
+        if record.size == 0:
+            continue
+        local_count = histogram[record.size]
+        count = local_count if sizes is None else sizes.get(record.size, 0)
+        # All the files of this size are in this shard
+        if count == local_count:
+            local_records.append(record)
+        elif count > local_count:
+            shared_records.append(record)
+    groups = [[record.path for record in group] for group in
+              iter_duplicate_records(local_records, buffer_size, jobs=jobs,
+                                     algorithm=algorithm)]
+    # Hash a single path for each inode
+    inode_dict = {}
+    for record in shared_records:
+        inode_dict.setdefault((record.device, record.inode), record)
+    hashed = list(inode_dict.values())
+    executor = create_executor(jobs)
+    try:
+        hashes = get_checksums([record.path for record in hashed],
+                               buffer_size,
+                               partial(get_file_checksum,
+                                       algorithm=algorithm), executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    digests = dict(zip(hashed, hashes))
+    shared = []
+    for record in shared_records:
+        digest = digests[inode_dict[(record.device, record.inode)]]
+        # Skip the files which can't be read
+        if digest:
+            shared.append([record.path, record.size, digest])
+
+    return {'algorithm': algorithm, 'groups': groups, 'digests': shared}
+
+
+def merge_partials(partials):
+    """
+    Return the groups of duplicates of all the shards.
+
+    @param partials: The partial results of the shards.
+
+    @return: A list of groups of duplicate files.
+
+    @raise ValueError: if the shards have not used the same hash function.
+    """
+    if len({result['algorithm'] for result in partials}) > 1:
+        raise ValueError("the shards have used different hash functions")
+    groups = []
+    digest_dict = {}
+    for result in partials:
+        groups += result['groups']
+        for path, size, digest in result['digests']:
+            digest_dict.setdefault((size, digest), []).append(path)
+    # Keep the groups found across shards in a stable order
+    groups += sorted(sorted(paths) for paths in digest_dict.values()
+                     if len(paths) > 1)
+
+    return groups
+
+
+# ---------------------------Main Function-------------------------
+def main():
+    """
+    Entry point of the script.
+    Exchange the partial results of the shards through JSON files.
+    """
+    args = get_argument()
+    if args.command == 'sizes':
+        histogram = get_size_histogram(scan_shard(args.path, args.shard))
+        data = {'sizes': histogram}
+    elif args.command == 'merge-sizes':
+        histograms = []
+        for file in args.histograms:
+            with open(file) as histogram:
+                histograms.append({int(size): count for size, count in
+                                   load(histogram)['sizes'].items()})
+        data = {'sizes': merge_size_histograms(histograms)}
+    elif args.command == 'digests':
+        sizes = None
+        if args.sizes:
+            with open(args.sizes) as histogram:
+                sizes = {int(size): count for size, count in
+                         load(histogram)['sizes'].items()}
+        records = list(scan_shard(args.path, args.shard))
+        data = find_shard_partial(records, sizes, args.hash, args.jobs)
+    else:
+        partials = []
+        for file in args.partials:
+            with open(file) as partial_file:
+                partials.append(load(partial_file))
+        print(dumps(merge_partials(partials)))
+        return
+    with open(args.output, 'w') as output:
+        output.write(dumps(data))
+
+
+if __name__ == "__main__":
+    main()
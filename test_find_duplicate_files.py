@@ -1,8 +1,17 @@
 from find_duplicate_files import *
+from watch_duplicate_files import *
+from benchmark_duplicate_files import run_benchmark, generate_corpus
+from benchmark_duplicate_files import PROFILES, load_bonus_finder
+from generate_duplicate_files import generate_files
+from shard_duplicate_files import *
 from subprocess import run, PIPE
-from os.path import getsize
-from os import chdir
+from os.path import getsize, abspath
+from hashlib import md5
+from unittest.mock import patch
+from threading import Thread
+from os import chdir, link
 import unittest
+import asyncio
 
 
 class MainTest(unittest.TestCase):
@@ -56,6 +65,30 @@ class MainTest(unittest.TestCase):
         for file in self.file_path_names:
             self.assertIn(file, files)
 
+    def test_scan_file_records_parallel(self):
+        """
+        Test if reading several directories at the same time finds the
+        same files as reading them one at a time.
+        """
+        records = sorted(scan_file_records('duplicates/'))
+        for workers in (2, 8):
+            self.assertEqual(sorted(scan_file_records('duplicates/', workers)),
+                             records)
+
+    def test_file_index(self):
+        """
+        Test if the index gives back the records of the files and groups
+        them by size like the dictionary of sizes.
+        """
+        records = list(scan_file_records('duplicates/'))
+        records.append(get_file_record('duplicates/dir1/test1'))
+        index = FileIndex(records)
+        self.assertEqual([index.get_record(file_id)
+                          for file_id in range(len(index))], records)
+        self.assertEqual([[index.get_record(file_id) for file_id in group]
+                          for group in index.group_by_size()],
+                         group_records_by_size(records))
+
     def test_create_size_dict(self):
         """
         Test if the empty file is not included in the result.
@@ -98,6 +131,920 @@ class MainTest(unittest.TestCase):
         self.assertEqual(file_hash2, None)
         run('rm -rf no_read.txt', shell=True)
 
+    def test_get_file_checksum_buffer_size(self):
+        """
+        Test if the hash is the same whatever the size of the buffer
+        used to read the file.
+        """
+        file = 'duplicates/dir1/test1'
+        hash = md5(b'This is test1').hexdigest()
+        for buffer_size in (1, 4, 13, BUFFER_SIZE):
+            self.assertEqual(get_file_checksum(file, buffer_size), hash)
+        # An empty buffer would give every file the hash of no content
+        for buffer_size in (0, -1):
+            with self.assertRaises(ValueError):
+                get_file_checksum(file, buffer_size)
+            with self.assertRaises(ArgumentTypeError):
+                positive_int(str(buffer_size))
+        with self.assertRaises(ValueError):
+            get_block_checksum(file, 0)
+        self.assertEqual(positive_int('4096'), 4096)
+
+    def test_get_block_checksum(self):
+        """
+        Test if the hash is computed on the first or the last block only,
+        or on the whole content if the file is smaller than the block.
+        """
+        file = 'duplicates/dir1/test1'
+        self.assertEqual(get_block_checksum(file, block_size=4),
+                         md5(b'This').hexdigest())
+        self.assertEqual(get_block_checksum(file, block_size=5,
+                                            from_end=True),
+                         md5(b'test1').hexdigest())
+        self.assertEqual(get_block_checksum(file, block_size=100,
+                                            from_end=True),
+                         md5(b'This is test1').hexdigest())
+
+    def test_find_duplicate_files_stages(self):
+        """
+        Test if files with the same head and tail but a different middle
+        are not reported as duplicates, whatever the stages used.
+        """
+        files = [abspath('duplicates/dir4/middle%d' % i) for i in range(3)]
+        for file, middle in zip(files, (b'x', b'y', b'x')):
+            with open(file, 'wb') as data:
+                data.write(b'a' * 64 + middle + b'b' * 64)
+        for head_size, tail_size in ((16, 16), (16, 0), (0, 0), (100, 100)):
+            groups = find_duplicate_files(files, 8, head_size, tail_size)
+            self.assertEqual(groups, [[files[0], files[2]]])
+
+    def test_find_duplicate_files_jobs(self):
+        """
+        Test if hashing the files with threads or processes gives the
+        same result as hashing them one at a time.
+        """
+        files = [abspath('duplicates/' + file) for file in (
+            'dir4/test2x', 'dir5/test2xx', 'dir5/dir6/test3', 'dir1/test1',
+            'dir1/dir2/test1x', 'dir1/dir2/dir3/test2')]
+        groups = find_duplicate_files(files)
+        self.assertEqual(find_duplicate_files(files, jobs=4), groups)
+        self.assertEqual(find_duplicate_files(files, jobs=2, processes=True),
+                         groups)
+
+    def test_hash_cache(self):
+        """
+        Test if a cached hash is used while the file is unchanged, and
+        replaced once the file has been modified.
+        """
+        file = abspath('duplicates/dir1/test1')
+        cache = HashCache('duplicates/cache.db')
+        cache.set('full', get_file_record(file), 'cached')
+        self.assertEqual(get_cached_checksums([get_file_record(file)],
+                                              cache=cache), ['cached'])
+        with open(file, 'a') as data:
+            data.write('modified')
+        hash = md5(b'This is test1modified').hexdigest()
+        self.assertEqual(get_cached_checksums([get_file_record(file)],
+                                              cache=cache), [hash])
+        self.assertEqual(cache.get('full', get_file_record(file)), hash)
+        cache.close()
+
+    def test_hash_cache_eviction(self):
+        """
+        Test if the cache doesn't keep more hashes than its maximum size.
+        """
+        records = [get_file_record('duplicates/dir1/test1'),
+                   get_file_record('duplicates/dir4/test2x')]
+        cache = HashCache('duplicates/cache.db', max_entries=1)
+        get_cached_checksums(records, cache=cache)
+        cache.close()
+        cache = HashCache('duplicates/cache.db', max_entries=1)
+        self.assertEqual(sum(cache.get('full', record) is not None
+                             for record in records), 1)
+        cache.close()
+
+    def test_hash_cache_used_batch(self):
+        """
+        Test if the hashes used are marked by batches instead of being
+        kept until the cache is closed.
+        """
+        records = [get_file_record('duplicates/dir1/test1'),
+                   get_file_record('duplicates/dir4/test2x'),
+                   get_file_record('duplicates/dir5/dir6/test3')]
+        cache = HashCache('duplicates/cache.db')
+        get_cached_checksums(records, cache=cache)
+        cache.close()
+        cache = HashCache('duplicates/cache.db')
+        cache.run_time += 1
+        with patch('find_duplicate_files.CACHE_USED_BATCH', 2):
+            get_cached_checksums(records, cache=cache)
+            self.assertEqual(len(cache.used_keys), 1)
+            used, = cache.connection.execute(
+                'SELECT COUNT(*) FROM checksums WHERE used = ?',
+                (cache.run_time,)).fetchone()
+            self.assertEqual(used, 2)
+            cache.close()
+
+    def test_scan_file_records(self):
+        """
+        Test if the records of the scanner have the status of the files
+        and are in the same order as the list of files.
+        """
+        records = list(scan_file_records('duplicates/'))
+        self.assertEqual([record.path for record in records],
+                         scan_files('duplicates/'))
+        for record in records:
+            self.assertEqual(record, get_file_record(record.path))
+            self.assertEqual(record.path, abspath(record.path))
+
+    def test_iter_duplicate_records(self):
+        """
+        Test if generating the groups by batches gives the same groups
+        as finding them all at once.
+        """
+        records = list(scan_file_records('duplicates/'))
+        groups = find_duplicate_records(records)
+        for batch_size in (1, 2, 100):
+            self.assertEqual(list(iter_duplicate_records(
+                records, batch_size=batch_size)), groups)
+
+    def test_find_duplicate_records_hardlinks(self):
+        """
+        Test if the paths linked to the same file are hashed once and
+        reported with the duplicates or in groups of their own.
+        """
+        test1 = abspath('duplicates/dir1/test1')
+        link(test1, 'duplicates/dir4/test1link')
+        link('duplicates/dir5/dir6/test3', 'duplicates/dir4/test3link')
+        records = list(scan_file_records('duplicates/'))
+        groups = [sorted(record.path for record in group)
+                  for group in find_duplicate_records(records)]
+        self.assertIn([abspath('duplicates/dir1/dir2/test1x'), test1,
+                       abspath('duplicates/dir4/test1link')], groups)
+        self.assertIn([abspath('duplicates/dir4/test3link'),
+                       abspath('duplicates/dir5/dir6/test3')], groups)
+        groups = find_duplicate_records(records, merge_links=False)
+        linked = [group for group in groups if is_linked_group(group)]
+        self.assertEqual(len(linked), 2)
+        for group in groups:
+            if group not in linked:
+                self.assertEqual(len(group), len({record.inode
+                                                  for record in group}))
+
+    def test_get_file_checksum_algorithm(self):
+        """
+        Test if the hash is computed with the chosen hash function, and
+        if the fastest hash function is one of the available ones.
+        """
+        file = 'duplicates/dir1/test1'
+        for algorithm in HASH_ALGORITHMS:
+            hash = HASH_ALGORITHMS[algorithm](b'This is test1').hexdigest()
+            self.assertEqual(get_file_checksum(file, algorithm=algorithm),
+                             hash)
+        self.assertIn(get_fastest_algorithm(), HASH_ALGORITHMS)
+
+    def test_find_duplicate_records_verify(self):
+        """
+        Test if confirming the duplicates with another hash function or
+        byte to byte gives the same groups.
+        """
+        records = list(scan_file_records('duplicates/'))
+        groups = find_duplicate_records(records)
+        for verify in ('sha256', 'bytes'):
+            self.assertEqual(find_duplicate_records(
+                records, algorithm='blake2b', verify=verify), groups)
+
+    def test_split_group_by_content(self):
+        """
+        Test if files of the same size are grouped by their content.
+        """
+        records = [get_file_record('duplicates/' + file) for file in (
+            'dir1/test1', 'dir4/test2x', 'dir1/dir2/test1x', 'dir5/test2xx',
+            'dir5/dir6/test3')]
+        self.assertEqual(split_group_by_content(records, 4),
+                         [[records[0], records[2]], [records[1], records[3]]])
+
+    def test_mapped_files(self):
+        """
+        Test if the files mapped in memory have the same hash and are
+        compared the same way as the files read into a buffer.
+        """
+        files = [abspath('duplicates/dir4/mapped%d' % i) for i in range(3)]
+        for file, last in zip(files, (b'x', b'x', b'y')):
+            with open(file, 'wb') as data:
+                data.write(b'a' * 1001 + last)
+        hash = md5(b'a' * 1001 + b'x').hexdigest()
+        for mmap_threshold in (0, 1, 1002):
+            self.assertEqual(get_file_checksum(files[0], 64,
+                             mmap_threshold=mmap_threshold), hash)
+            self.assertTrue(compare_files(files[0], files[1], 64,
+                                          mmap_threshold))
+            self.assertFalse(compare_files(files[0], files[2], 64,
+                                           mmap_threshold))
+
+    def test_snapshot(self):
+        """
+        Test if an incremental scan finds the files added since the
+        snapshot and only searches the duplicates of their size again.
+        """
+        snapshot = Snapshot('snapshot.db')
+        records = list(snapshot.scan('duplicates/'))
+        self.assertEqual(records, list(scan_file_records('duplicates/')))
+        options = {'hash': 'md5'}
+        groups = list(snapshot.find_duplicates(records, options,
+                                               iter_duplicate_records))
+        snapshot.save()
+        with open('duplicates/dir4/test3x', 'w') as test3x:
+            test3x.write('This is test3')
+        snapshot = Snapshot('snapshot.db')
+        records = list(snapshot.scan('duplicates/'))
+        self.assertEqual(sorted(records),
+                         sorted(scan_file_records('duplicates/')))
+        searched = []
+
+        def find_duplicates(records):
+            searched.extend(records)
+            return iter_duplicate_records(records)
+
+        new_groups = list(snapshot.find_duplicates(records, options,
+                                                   find_duplicates))
+        self.assertEqual({record.size for record in searched}, {13})
+        self.assertIn([abspath('duplicates/dir4/test3x'),
+                       abspath('duplicates/dir5/dir6/test3')],
+                      [sorted(record.path for record in group)
+                       for group in new_groups])
+        self.assertEqual(len(new_groups), len(groups) + 1)
+        run('rm -f snapshot.db*', shell=True)
+        # The directories modified are read by the scanner given
+        scanned = []
+
+        def scanner(directory, scan_filter=None, stats=None):
+            scanned.append(directory)
+            return scan_directory(directory, scan_filter, stats)
+
+        records = list(Snapshot('snapshot.db').scan('duplicates/',
+                                                    scanner=scanner))
+        self.assertEqual(records, list(scan_file_records('duplicates/')))
+        self.assertIn(abspath('duplicates/dir4'), scanned)
+        run('rm -f snapshot.db*', shell=True)
+
+    def test_snapshot_resized_file(self):
+        """
+        Test if an incremental scan doesn't keep a group of the snapshot
+        when a file other than the first of the group changes of size.
+        """
+        run('rm -rf snapshot_tree && mkdir snapshot_tree', shell=True)
+        for name in ('a', 'b', 'c'):
+            with open(join('snapshot_tree', name), 'w') as file:
+                file.write('0123456789')
+        snapshot = Snapshot('snapshot.db')
+        records = list(snapshot.scan('snapshot_tree'))
+        options = {'hash': 'md5'}
+        groups = list(snapshot.find_duplicates(records, options,
+                                               iter_duplicate_records))
+        snapshot.save()
+        self.assertEqual(len(groups), 1)
+        first, resized = groups[0][0].path, groups[0][1].path
+        # Replace the file so that its directory is read again
+        with open('snapshot_tree/new', 'w') as file:
+            file.write('012345678901234567')
+        run(['mv', 'snapshot_tree/new', resized])
+        snapshot = Snapshot('snapshot.db')
+        records = list(snapshot.scan('snapshot_tree'))
+        groups = list(snapshot.find_duplicates(records, options,
+                                               iter_duplicate_records))
+        self.assertEqual(len(groups), 1)
+        self.assertNotIn(resized, [record.path for record in groups[0]])
+        self.assertIn(first, [record.path for record in groups[0]])
+        self.assertEqual({record.size for record in groups[0]}, {10})
+        run('rm -rf snapshot_tree snapshot.db*', shell=True)
+
+    def test_duplicate_index(self):
+        """
+        Test if the index only searches again the duplicates of the sizes
+        of the files changed.
+        """
+        records = list(scan_file_records('duplicates/'))
+        index = DuplicateIndex(iter_duplicate_records, records)
+        self.assertEqual(len(index.groups[13]), 2)
+        with open('duplicates/dir4/test3x', 'w') as test3x:
+            test3x.write('This is test3')
+        changes = index.refresh(
+            index.add(get_file_record(abspath('duplicates/dir4/test3x'))))
+        self.assertEqual([size for size, _ in changes], [13])
+        self.assertIn([abspath('duplicates/dir4/test3x'),
+                       abspath('duplicates/dir5/dir6/test3')],
+                      [[record.path for record in group]
+                       for group in changes[0][1]])
+        changes = index.refresh(
+            index.remove(abspath('duplicates/dir4/test3x')))
+        self.assertEqual([len(groups) for _, groups in changes], [2])
+        self.assertEqual(index.refresh({13}), [])
+
+    def test_watch_events(self):
+        """
+        Test if the creation of a duplicate inside a watched directory
+        updates its groups.
+        """
+        inotify = Inotify()
+        try:
+            path = abspath('duplicates/')
+            index = DuplicateIndex(iter_duplicate_records,
+                                   watch_tree(inotify, path))
+            run('mkdir duplicates/dir7 && '
+                'cp duplicates/dir5/dir6/test3 duplicates/dir4/test3x',
+                shell=True)
+            events = inotify.read_events(1)
+            stats = ScanStats()
+            sizes = apply_events(index, inotify, events, stats=stats)
+            self.assertEqual(sizes, {13})
+            self.assertIn(abspath('duplicates/dir7'),
+                          inotify.directories.values())
+            self.assertEqual(stats.report()['scan']['directories'], 1)
+            changes = index.refresh(sizes)
+            self.assertEqual(len(changes[0][1]), 3)
+        finally:
+            inotify.close()
+
+    def test_watch_moved_root(self):
+        """
+        Test if moving the watched directory emits its groups as removed
+        and stops the watch.
+        """
+        run('rm -rf watch_tree watch_moved && mkdir watch_tree && '
+            'cp duplicates/dir1/test1 duplicates/dir1/dir2/test1x '
+            'watch_tree', shell=True)
+        emitted = []
+        watch = Thread(target=watch_duplicate_files,
+                       args=('watch_tree', iter_duplicate_records,
+                             emitted.append), daemon=True)
+        watch.start()
+        for _ in range(100):
+            if emitted:
+                break
+            watch.join(0.05)
+        run('mv watch_tree watch_moved', shell=True)
+        watch.join(5)
+        run('rm -rf watch_tree watch_moved', shell=True)
+        self.assertFalse(watch.is_alive())
+        self.assertEqual([[(size, len(groups)) for size, groups in changes]
+                          for changes in emitted], [[(13, 1)], [(13, 0)]])
+
+    def test_duplicate_index_reset(self):
+        """
+        Test if replacing all the files of the index returns the sizes of
+        the files removed and added.
+        """
+        records = list(scan_file_records('duplicates/'))
+        index = DuplicateIndex(iter_duplicate_records, records)
+        kept = [record for record in records if record.size != 13]
+        sizes = index.reset(kept)
+        self.assertEqual(sizes, {record.size for record in records})
+        self.assertEqual(list(index.records.values()), kept)
+        self.assertEqual([size for size, _ in index.refresh(sizes)], [13])
+
+    def test_find_duplicates_async(self):
+        """
+        Test if the asynchronous scan finds the same groups as the scan,
+        and can be stopped before the end.
+        """
+        async def collect(queue_size, limit=None):
+            groups = []
+            async for group in find_duplicates_async('duplicates/',
+                                                     queue_size=queue_size):
+                groups.append(group)
+                if len(groups) == limit:
+                    break
+            return groups
+
+        groups = list(iter_duplicate_records(
+            scan_file_records('duplicates/')))
+        self.assertEqual(asyncio.run(collect(1)), groups)
+        self.assertEqual(asyncio.run(collect(1, limit=1)), groups[:1])
+
+    def test_find_duplicates_async_cancel(self):
+        """
+        Test if cancelling the asynchronous scan stops the hashing before
+        the next checksum stage.
+        """
+        run('rm -rf async_tree && mkdir async_tree', shell=True)
+        # Files hashed with 3 stages
+        for name, data in (('a1', b'a' * 20000), ('a2', b'a' * 20000),
+                           ('b1', b'b' * 30000), ('b2', b'b' * 30000)):
+            with open(join('async_tree', name), 'wb') as file:
+                file.write(data)
+        hashing = Event()
+        release = Event()
+        stages = []
+        split = split_groups_by_checksum
+
+        def split_when_released(*args, **kwargs):
+            stages.append(args)
+            hashing.set()
+            release.wait(10)
+            return split(*args, **kwargs)
+
+        async def cancel(executor):
+            async def collect():
+                return [group async for group in find_duplicates_async(
+                    'async_tree', executor)]
+
+            task = asyncio.create_task(collect())
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, hashing.wait, 10)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        executor = ThreadPoolExecutor(1)
+        with patch('find_duplicate_files.split_groups_by_checksum',
+                   split_when_released):
+            asyncio.run(cancel(executor))
+            release.set()
+            start = perf_counter()
+            executor.shutdown()
+        run('rm -rf async_tree', shell=True)
+        self.assertLess(perf_counter() - start, 5)
+        # No other stage is started once the search is cancelled
+        self.assertEqual(len(stages), 1)
+
+    def test_generate_corpus(self):
+        """
+        Test if a corpus is generated the same way with the same seed.
+        """
+        profile = PROFILES['same-size']
+        corpora = [generate_corpus('benchmark/%d' % index, profile, seed=1,
+                                   scale=0.05) for index in range(2)]
+        self.assertEqual(corpora[0], corpora[1])
+        self.assertEqual(sorted(scan_files('benchmark/0')),
+                         sorted(file.replace('benchmark/1', 'benchmark/0')
+                                for file in scan_files('benchmark/1')))
+        run('rm -rf benchmark/', shell=True)
+
+    def test_generate_files(self):
+        """
+        Test if the files generated by several workers are the same as
+        the ones generated by one, and if the duplicates can be linked.
+        """
+        options = {'file_min_size': 1, 'file_max_size': 256 * 1024,
+                   'duplicate_file_ratio': 0.5, 'directory_max_depth': 1,
+                   'seed': 2}
+        files = generate_files(10, root_path='benchmark/0', **options)
+        linked = generate_files(10, root_path='benchmark/1', workers=2,
+                                duplicate_mode='hardlink', **options)
+        for (file, size), (linked_file, linked_size) in zip(files, linked):
+            self.assertEqual(getsize(file), size)
+            self.assertEqual(size, linked_size)
+            self.assertEqual(get_file_checksum(file),
+                             get_file_checksum(linked_file))
+        self.assertEqual(len(find_duplicate_files(scan_files('benchmark/0'))),
+                         len(find_duplicate_files(scan_files('benchmark/1'))))
+        self.assertTrue(any(stat(file).st_nlink > 1 for file, _ in linked))
+        # Without seed, the content is read from the operating system
+        options['seed'] = None
+        for file, size in generate_files(10, root_path='benchmark/2',
+                                         **options):
+            self.assertEqual(getsize(file), size)
+        run('rm -rf benchmark/', shell=True)
+
+    def test_run_benchmark(self):
+        """
+        Test if both finders are timed at each stage and find the same
+        number of groups of duplicates.
+        """
+        results = run_benchmark('benchmark', ['hardlinks'], rounds=1,
+                                scale=0.02)
+        run('rm -rf benchmark/', shell=True)
+        self.assertEqual([result['finder'] for result in results],
+                         ['main', 'bonus'])
+        self.assertEqual(list(results[0]['stages']),
+                         ['scan', 'search', 'output'])
+        self.assertEqual(list(results[0]['search_stages'])[:2],
+                         ['size', 'md5:head:4096'])
+        self.assertEqual(list(results[1]['stages']),
+                         ['scan', 'size', 'compare', 'output'])
+        self.assertEqual(results[0]['groups'], results[1]['groups'])
+        self.assertGreater(results[0]['groups'], 0)
+
+    def test_scan_stats(self):
+        """
+        Test if the files scanned and read at each stage are counted, and
+        if the hooks are called with the counters of each stage.
+        """
+        stages = set()
+        stats = ScanStats([lambda stage, counters: stages.add(stage)])
+        records = list(scan_file_records('duplicates/', stats=stats))
+        groups = list(iter_duplicate_records(records, stats=stats))
+        report = stats.report()
+        self.assertEqual(report['scan']['files'], len(records))
+        self.assertEqual(stages, set(report))
+        self.assertEqual(list(report)[:3], ['scan', 'size',
+                                            'md5:head:4096'])
+        self.assertEqual(report['size']['files_in'], len(records))
+        sizes = [record.size for record in records]
+        self.assertEqual(report['md5:head:4096']['bytes_read'],
+                         sum(min(size, 4096) for size in sizes
+                             if size and sizes.count(size) > 1))
+        self.assertEqual(report['md5:head:4096']['files_out'],
+                         sum(map(len, groups)))
+
+    def test_scan_stats_stat_calls(self):
+        """
+        Test if the files stat'ed then skipped by their size are counted
+        as stat calls, and if the scans of the other modes are counted.
+        """
+        records = list(scan_file_records('duplicates/'))
+        scan_filter = create_scan_filter(min_size=1)
+        kept = [record for record in records if record.size >= 1]
+        for scanner in {scan_directory, get_scanner('statx')}:
+            stats = ScanStats()
+            self.assertEqual(len(list(scan_file_records(
+                'duplicates/', stats=stats, scan_filter=scan_filter,
+                scanner=scanner))), len(kept))
+            self.assertEqual(stats.report()['scan']['stat_calls'],
+                             len(records))
+            self.assertEqual(stats.report()['scan']['files'], len(kept))
+        stats = ScanStats()
+        snapshot = Snapshot('snapshot.db')
+        self.assertEqual(len(list(snapshot.scan('duplicates/',
+                                                stats=stats))),
+                         len(records))
+        snapshot.save()
+        self.assertEqual(stats.report()['scan']['files'], len(records))
+        stats = ScanStats()
+        list(Snapshot('snapshot.db').scan('duplicates/', stats=stats))
+        self.assertEqual(stats.report()['scan']['files_unchanged'],
+                         len(records))
+        run('rm -f snapshot.db*', shell=True)
+        stats = ScanStats()
+        checkpoint = Checkpoint('checkpoint.db')
+        list(checkpoint.scan('duplicates/', stats=stats))
+        checkpoint.close()
+        run('rm -f checkpoint.db*', shell=True)
+        self.assertEqual(stats.report()['scan']['files'], len(records))
+
+    def test_checkpoint(self):
+        """
+        Test if a scan stopped after a save is resumed without missing or
+        repeating a file.
+        """
+        checkpoint = Checkpoint('checkpoint.db', interval=0)
+        scan = checkpoint.scan('duplicates/')
+        first_records = [next(scan) for _ in range(3)]
+        scan.close()
+        checkpoint.close()
+        checkpoint = Checkpoint('checkpoint.db')
+        saved, = checkpoint.connection.execute(
+            'SELECT COUNT(*) FROM checkpoint_files').fetchone()
+        self.assertGreaterEqual(saved, 3)
+        records = list(checkpoint.scan('duplicates/', resume=True))
+        checkpoint.close()
+        self.assertEqual(records[:3], first_records)
+        self.assertEqual(records, list(scan_file_records('duplicates/')))
+        run('rm -f checkpoint.db*', shell=True)
+        # The directories are read by the scanner given
+        scanned = []
+
+        def scanner(directory, scan_filter=None, stats=None):
+            scanned.append(directory)
+            return scan_directory(directory, scan_filter, stats)
+
+        checkpoint = Checkpoint('checkpoint.db')
+        records = list(checkpoint.scan('duplicates/', scanner=scanner))
+        checkpoint.close()
+        self.assertEqual(records, list(scan_file_records('duplicates/')))
+        self.assertIn(abspath('duplicates/dir4'), scanned)
+        run('rm -f checkpoint.db*', shell=True)
+
+    def test_hash_cache_checkpoint(self):
+        """
+        Test if the hashes are saved before the cache is closed.
+        """
+        records = list(scan_file_records('duplicates/'))
+        cache = HashCache('checkpoint.db', checkpoint_interval=0)
+        find_duplicate_records(records, cache=cache)
+        saved = HashCache('checkpoint.db')
+        self.assertTrue(all(saved.get('md5:head:4096', record)
+                            for group in find_duplicate_records(records)
+                            for record in group))
+        saved.close()
+        cache.close()
+        run('rm -f checkpoint.db*', shell=True)
+
+    def test_merge_partials(self):
+        """
+        Test if the shards of a tree, by sub-directories or by sizes, find
+        the same duplicates as the whole tree.
+        """
+        expected = sorted(sorted(record.path for record in group)
+                          for group in iter_duplicate_records(
+                              scan_file_records('duplicates/')))
+        subtrees = [['duplicates/dir1'], ['duplicates/dir4',
+                                          'duplicates/dir5']]
+        records = [list(scan_shard(paths)) for paths in subtrees]
+        sizes = merge_size_histograms(map(get_size_histogram, records))
+        partials = [find_shard_partial(shard, sizes) for shard in records]
+        self.assertEqual(sorted(map(sorted, merge_partials(partials))),
+                         sorted(sorted(record.path for record in group)
+                                for group in iter_duplicate_records(
+                                    records[0] + records[1])))
+        self.assertTrue(partials[0]['digests'])
+        partials = [find_shard_partial(list(scan_shard(['duplicates/'],
+                                                       (index, 3))))
+                    for index in range(3)]
+        self.assertEqual(sorted(map(sorted, merge_partials(partials))),
+                         expected)
+
+    def test_scan_filter(self):
+        """
+        Test if the files and directories filtered out are skipped during
+        the scan.
+        """
+        records = list(scan_file_records('duplicates/'))
+        scan_filter = create_scan_filter(exclude=['test1*'], min_size=1,
+                                         prune=['dir6', '*/dir2'])
+        self.assertEqual(
+            list(scan_file_records('duplicates/', scan_filter=scan_filter)),
+            [record for record in records if record.size >= 1 and
+             '/dir6/' not in record.path and '/dir2/' not in record.path and
+             not record.path.rsplit('/', 1)[1].startswith('test1')])
+        scan_filter = create_scan_filter(extensions=['.TXT'])
+        self.assertEqual(
+            [record.path for record in scan_file_records(
+                'duplicates/', 2, scan_filter=scan_filter)],
+            [record.path for record in records
+             if record.path.endswith('.txt')])
+        self.assertIsNone(create_scan_filter())
+
+    def test_scan_directory_vanished_entry(self):
+        """
+        Test if a file removed between the listing of its directory and its
+        stat is skipped alone, keeping the other entries.
+        """
+        run('rm -rf vanished && mkdir -p vanished/sub && '
+            'touch vanished/a vanished/b vanished/c', shell=True)
+        listing = scandir
+
+        class VanishedEntry:
+            def __init__(self, entry):
+                self.entry = entry
+
+            def __getattr__(self, name):
+                return getattr(self.entry, name)
+
+            def stat(self):
+                if self.entry.name == 'a':
+                    raise FileNotFoundError(self.entry.path)
+                return self.entry.stat()
+
+        class VanishedListing:
+            def __init__(self, directory):
+                self.entries = listing(directory)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exception):
+                self.entries.close()
+
+            def __iter__(self):
+                # List the removed file first
+                return (VanishedEntry(entry) for entry in
+                        sorted(self.entries, key=lambda entry: entry.name))
+
+        directory = abspath('vanished')
+        with patch('find_duplicate_files.scandir', VanishedListing):
+            records, sub_directories = scan_directory(directory)
+        self.assertEqual(sorted(record.path for record in records),
+                         [join(directory, 'b'), join(directory, 'c')])
+        self.assertEqual(sub_directories, [join(directory, 'sub')])
+        run('rm -rf vanished', shell=True)
+
+    def test_statx_scanner(self):
+        """
+        Test if the statx scanner returns the same records as os.scandir,
+        or is replaced by scan_directory when it isn't available.
+        """
+        scanner = get_scanner('statx')
+        self.assertIs(get_scanner('scandir'), scan_directory)
+        if scanner is scan_directory:
+            self.skipTest("statx is not available on this system")
+        scan_filter = create_scan_filter(exclude=['test1*'], prune=['dir6'])
+        for options in ({}, {'scan_filter': scan_filter}):
+            self.assertEqual(
+                sorted(scan_file_records('duplicates/', **options)),
+                sorted(scan_file_records('duplicates/', scanner=scanner,
+                                         **options)))
+        self.assertEqual(scanner('duplicates/missing'), ([], []))
+
+    def test_content_index(self):
+        """
+        Test if the duplicates of a file, the groups wasting the most space
+        and the groups inside a directory are read back from the index.
+        """
+        records = list(scan_file_records('duplicates/'))
+        groups = list(iter_duplicate_records(records))
+        content_index = ContentIndex('index.db')
+        content_index.save('duplicates/', records, groups,
+                           get_group_digests(groups))
+        top_groups = content_index.get_top_groups(len(groups) + 1)
+        self.assertEqual(sorted(sorted(group.paths) for group in top_groups),
+                         sorted(sorted(record.path for record in group)
+                                for group in groups))
+        self.assertEqual([group.wasted for group in top_groups],
+                         sorted((group[0].size * (len(group) - 1)
+                                 for group in groups), reverse=True))
+        group = top_groups[0]
+        self.assertEqual(group.digest, get_file_checksum(group.paths[0]))
+        self.assertEqual(content_index.get_duplicates(group.paths[0]),
+                         group.paths[1:])
+        self.assertIsNone(content_index.get_duplicates('duplicates/none'))
+        self.assertEqual(
+            sorted(content_index.get_directory_groups('duplicates/')),
+            sorted(top_groups))
+        self.assertEqual(content_index.get_directory_groups('duplicate'), [])
+        content_index.close()
+        run('rm -f index.db*', shell=True)
+
+    def test_priority_budget(self):
+        """
+        Test if the sizes freeing the most bytes are hashed first and if
+        the sizes outside of the budgets are skipped.
+        """
+        records = list(scan_file_records('duplicates/'))
+        groups = list(iter_duplicate_records(records))
+        priority_groups = list(iter_duplicate_records(records, priority=True))
+        self.assertEqual(sorted(priority_groups), sorted(groups))
+        self.assertEqual([get_reclaimable_size(group)
+                          for group in priority_groups],
+                         sorted((get_reclaimable_size(group)
+                                 for group in groups), reverse=True))
+        stats = ScanStats()
+        self.assertEqual(list(iter_duplicate_records(records, time_budget=0,
+                                                     stats=stats)), [])
+        self.assertEqual(stats.report()['budget']['groups_skipped'],
+                         len({record.size for group in groups
+                              for record in group}))
+        top = priority_groups[0]
+        size_records = [record for record in records
+                        if record.size == top[0].size]
+        budget_groups = list(iter_duplicate_records(
+            records, priority=True,
+            byte_budget=top[0].size * len(size_records)))
+        self.assertIn(top, budget_groups)
+        self.assertEqual({group[0].size for group in budget_groups},
+                         {top[0].size})
+        self.assertEqual(list(iter_duplicate_records(records,
+                                                     byte_budget=0)), [])
+
+    def test_bonus_group_files_by_diff(self):
+        """
+        Test if the files compared all together chunk by chunk give the same
+        groups, in the same order, as comparing them pair by pair, whether
+        they are kept open, opened for each chunk or mapped in memory.
+        """
+        bonus = load_bonus_finder()
+        run('rm -rf bonus_tree && mkdir bonus_tree', shell=True)
+        content = bytes(range(20))
+        # Files differing from the first one at different offsets, the
+        # ones with the same offset being equal
+        contents = {'a': content, 'b': content, 'c': content,
+                    'd': content[:1] + b'x' + content[2:],
+                    'e': content[:10] + b'x' + content[11:],
+                    'f': content[:1] + b'x' + content[2:],
+                    'g': content[:19] + b'x',
+                    'h': content[:10] + b'x' + content[11:]}
+        for name, data in contents.items():
+            with open(join('bonus_tree', name), 'wb') as file:
+                file.write(data)
+        files = [abspath(join('bonus_tree', name))
+                 for name in 'hgfedcba']
+        unreadable = files[1]
+
+        def is_readable(file, mode):
+            return file != unreadable
+
+        def read(file):
+            with open(file, 'rb') as data:
+                return data.read()
+
+        # The groups of the pairwise comparison which has been replaced
+        expected = []
+        for file1 in files:
+            group = sorted(
+                [file1] + [file2 for file2 in files if file2 != file1 and
+                           is_readable(file1, R_OK) and
+                           is_readable(file2, R_OK) and
+                           read(file1) == read(file2)])
+            if group not in expected:
+                expected.append(group)
+        self.assertIn([unreadable], expected)
+        self.assertEqual(len(expected), 4)
+        with patch.object(bonus, 'access', is_readable):
+            self.assertEqual(bonus.group_files_by_diff(files), expected)
+            self.assertEqual(bonus.group_files_by_diff(files, chunk_size=3),
+                             expected)
+            # More files than can be opened at the same time
+            self.assertEqual(bonus.group_files_by_diff(
+                files, chunk_size=3, max_open_files=2), expected)
+            with patch.object(bonus, 'MMAP_THRESHOLD', 1):
+                self.assertEqual(bonus.group_files_by_diff(
+                    files, chunk_size=3), expected)
+        run('rm -rf bonus_tree', shell=True)
+
+    def test_bonus_chunk_size(self):
+        """
+        Test if the chunks of every file of a group fit in the memory
+        budget, whatever the number of files and of jobs.
+        """
+        bonus = load_bonus_finder()
+        self.assertEqual(bonus.get_chunk_size(2, 4), bonus.CHUNK_SIZE)
+        for file_count, jobs, memory_budget in (
+                (100000, 8, bonus.MEMORY_BUDGET), (1000, 8, 1024 * 1024),
+                (7, 3, 100), (1, 1, 1)):
+            chunk_size = bonus.get_chunk_size(file_count, jobs,
+                                              memory_budget)
+            self.assertGreaterEqual(chunk_size, 1)
+            self.assertLessEqual(chunk_size * file_count, memory_budget)
+        # A group too big for its share takes the whole budget instead
+        self.assertEqual(bonus.get_chunk_size(1000, 8, 8 * 1024 * 1024),
+                         bonus.MIN_CHUNK_SIZE)
+        with self.assertRaises(ValueError):
+            bonus.get_chunk_size(2, 1, 1)
+
+    def test_bonus_parallel(self):
+        """
+        Test if the groups compared in parallel are the same and in the
+        same order as the groups compared one at a time, without reading
+        more bytes at the same time than the memory budget.
+        """
+        bonus = load_bonus_finder()
+        run('rm -rf bonus_tree && mkdir bonus_tree', shell=True)
+        for index in range(60):
+            # 20 sizes of 3 files, the last two of each size being equal
+            with open('bonus_tree/%02d' % index, 'wb') as data:
+                data.write(bytes([index % 3 > 0]) * (index // 3 + 1) * 1000)
+        files = bonus.scan_files('bonus_tree')
+        groups = bonus.find_duplicate_files(files)
+        self.assertEqual(sum(len(group) == 2 for group in groups), 20)
+        peaks = []
+
+        class TrackedBudget(bonus.MemoryBudget):
+            def acquire(self, size):
+                super().acquire(size)
+                with self.condition:
+                    peaks.append(memory_budget - self.available)
+
+        memory_budget = 10 * 1000
+        with patch.object(bonus, 'MemoryBudget', TrackedBudget):
+            self.assertEqual(bonus.find_duplicate_files(files, 4,
+                                                        memory_budget),
+                             groups)
+        self.assertTrue(peaks)
+        self.assertLessEqual(max(peaks), memory_budget)
+        run('rm -rf bonus_tree', shell=True)
+
+    def test_time_budget(self):
+        """
+        Test if the time budget is checked before each size group and each
+        checksum stage, even inside a single batch.
+        """
+        run('rm -rf budget_tree && mkdir budget_tree', shell=True)
+        # Sizes hashed with 3 stages, 1 stage and 1 stage, from the one
+        # freeing the most bytes to the one freeing the least
+        for name, data in (('a1', b'a' * 20000), ('a2', b'a' * 20000),
+                           ('a3', b'b' * 20000), ('b1', b'b' * 100),
+                           ('b2', b'b' * 100), ('c1', b'c' * 50),
+                           ('c2', b'c' * 50)):
+            with open(join('budget_tree', name), 'wb') as file:
+                file.write(data)
+        records = list(scan_file_records('budget_tree'))
+        now = [0]
+        split = split_groups_by_checksum
+
+        def split_in_one_second(*args, **kwargs):
+            now[0] += 1
+            return split(*args, **kwargs)
+
+        results = {}
+        for time_budget in (2, 4):
+            now[0] = 0
+            stats = ScanStats()
+            with patch('find_duplicate_files.perf_counter', lambda: now[0]), \
+                    patch('find_duplicate_files.split_groups_by_checksum',
+                          split_in_one_second):
+                groups = iter_duplicate_records(records,
+                                                time_budget=time_budget,
+                                                priority=True, stats=stats)
+                results[time_budget] = (
+                    [sorted(name.rsplit(sep, 1)[1] for name, *_ in group)
+                     for group in groups],
+                    stats.report()['budget']['groups_skipped'])
+        run('rm -rf budget_tree', shell=True)
+        # The largest size isn't finished before its last stage
+        self.assertEqual(results[2], ([], 3))
+        self.assertEqual(results[4], ([['a1', 'a2'], ['b1', 'b2']], 1))
+
     def test_create_hash_dict(self):
         """
         Test if the empty file is not in the dict's values.
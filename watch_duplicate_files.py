@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+
+from find_duplicate_files import scan_directory, get_file_record
+from find_duplicate_files import is_pruned, is_name_kept, is_size_kept
+from os import read, close, fsencode, fsdecode, O_CLOEXEC
+from ctypes import CDLL, get_errno, c_char_p, c_int, c_uint32
+from os.path import join, abspath
+from ctypes.util import find_library
+from struct import calcsize, unpack_from
+from errno import EINTR
+from select import select
+from json import dumps
+
+
+# Events of the kernel watched on every directory of the tree.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+# Events received for a directory watched.  A file is hashed once it has
+# been closed after being written, not on every write.
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | \
+    IN_ONLYDIR | IN_DONT_FOLLOW
+
+# Layout of the header of an event read from an inotify file descriptor:
+# watch descriptor, mask, cookie and length of the name.
+EVENT_FORMAT = 'iIII'
+EVENT_SIZE = calcsize(EVENT_FORMAT)
+
+# Size in bytes of the buffer used to read the events, enough for
+# hundreds of events at once.
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+# ---------------------Linux Inotify-------------------------------
+class Inotify:
+    """
+    Minimal wrapper of the inotify API of the Linux kernel through ctypes,
+    to be notified of the changes inside a set of directories.
+    """
+
+    def __init__(self):
+        """
+        Create the inotify instance.
+
+        @raise OSError: if inotify is not available on this system.
+        """
+        self.libc = CDLL(find_library('c'), use_errno=True)
+        self.libc.inotify_init1.argtypes = [c_int]
+        self.libc.inotify_add_watch.argtypes = [c_int, c_char_p, c_uint32]
+        self.libc.inotify_rm_watch.argtypes = [c_int, c_int]
+        self.fd = self.libc.inotify_init1(O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+
+    def add_watch(self, directory, mask=WATCH_MASK):
+        """
+        Watch the changes of the entries of a directory.
+
+        @param directory: An absolute path of a directory.
+
+        @param mask: The events to watch.
+
+        @raise OSError: if the directory can't be watched.
+        """
+        watch = self.libc.inotify_add_watch(self.fd, fsencode(directory),
+                                            mask)
+        if watch < 0:
+            raise OSError(get_errno(), 'inotify_add_watch failed', directory)
+        self.directories[watch] = directory
+
+    def read_events(self, timeout=None):
+        """
+        Return the events received since the last call, waiting for at
+        least one event.
+
+        @param timeout: The maximum number of seconds to wait, None to wait
+        until an event is received.
+
+        @return: A list of tuples of the directory, the mask of the event
+        and the name of the entry, empty for the directory itself.
+        """
+        try:
+            ready, _, _ = select([self.fd], [], [], timeout)
+        except InterruptedError:
+            return []
+        if not ready:
+            return []
+        try:
+            data = read(self.fd, EVENT_BUFFER_SIZE)
+        except OSError as error:
+            if error.errno == EINTR:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(data):
+            watch, mask, _, length = unpack_from(EVENT_FORMAT, data, offset)
+            offset += EVENT_SIZE
+            name = fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            # The watch of a removed directory is removed by the kernel
+            if mask & IN_IGNORED:
+                self.directories.pop(watch, None)
+                continue
+            events.append((self.directories.get(watch), mask, name))
+
+        return events
+
+    def close(self):
+        """
+        Stop watching all the directories.
+        """
+        close(self.fd)
+
+
+# ---------------------Index of Duplicates-------------------------
+def sort_groups(groups):
+    """
+    Return groups of duplicates in an order which doesn't depend on the
+    order the files have been scanned, so they can be compared.
+
+    @param groups: An iterable of groups of FileRecord.
+
+    @return: A sorted list of groups of FileRecord sorted by path.
+    """
+    return sorted(sorted(group) for group in groups)
+
+
+class DuplicateIndex:
+    """
+    Groups of duplicates of a tree kept up to date file by file.
+
+    The files are kept by size, so a change to a file only searches again
+    the duplicates of the files with its old size and its new size.
+    """
+
+    def __init__(self, find_duplicates, records=()):
+        """
+        Create the index of a list of files.
+
+        @param find_duplicates: The function generating the groups of
+        duplicates of a list of FileRecord.
+
+        @param records: An iterable of FileRecord.
+        """
+        self.find_duplicates = find_duplicates
+        self.records = {}
+        self.size_dict = {}
+        self.groups = {}
+        self.reset(records)
+        groups = sort_groups(find_duplicates(list(self.records.values())))
+        for group in groups:
+            self.groups.setdefault(group[0].size, []).append(group)
+
+    def add(self, record):
+        """
+        Add or replace a file in the index.
+
+        @param record: The FileRecord of the file.
+
+        @return: The set of sizes whose groups may have changed.
+        """
+        sizes = self.remove(record.path)
+        self.records[record.path] = record
+        self.size_dict.setdefault(record.size, set()).add(record.path)
+        sizes.add(record.size)
+
+        return sizes
+
+    def reset(self, records):
+        """
+        Replace all the files of the index, keeping the groups until the
+        sizes returned are refreshed.
+
+        @param records: An iterable of FileRecord.
+
+        @return: The set of sizes whose groups may have changed.
+        """
+        sizes = set(self.size_dict)
+        self.records.clear()
+        self.size_dict.clear()
+        for record in records:
+            sizes |= self.add(record)
+
+        return sizes
+
+    def remove(self, path):
+        """
+        Remove a file from the index.
+
+        @param path: The absolute path of the file.
+
+        @return: The set of sizes whose groups may have changed.
+        """
+        record = self.records.pop(path, None)
+        if record is None:
+            return set()
+        paths = self.size_dict[record.size]
+        paths.discard(path)
+        if not paths:
+            del self.size_dict[record.size]
+
+        return {record.size}
+
+    def remove_directory(self, directory):
+        """
+        Remove all the files inside a directory from the index.
+
+        @param directory: The absolute path of the directory.
+
+        @return: The set of sizes whose groups may have changed.
+        """
+        prefix = join(directory, '')
+        sizes = set()
+        for path in [path for path in self.records
+                     if path.startswith(prefix)]:
+            sizes |= self.remove(path)
+
+        return sizes
+
+    def refresh(self, sizes):
+        """
+        Search again the duplicates of the files with some sizes.
+
+        @param sizes: The sizes whose groups may have changed.
+
+        @return: A list of tuples of a size and its new groups of
+        duplicates, for the sizes whose groups have changed.
+        """
+        changes = []
+        for size in sorted(sizes):
+            records = [self.records[path]
+                       for path in sorted(self.size_dict.get(size, ()))]
+            groups = sort_groups(self.find_duplicates(records)) \
+                if len(records) > 1 else []
+            if groups != self.groups.get(size, []):
+                if groups:
+                    self.groups[size] = groups
+                else:
+                    self.groups.pop(size, None)
+                changes.append((size, groups))
+
+        return changes
+
+
+# ---------------------Watching the Tree---------------------------
+def watch_tree(inotify, path, scan_filter=None, stats=None):
+    """
+    Watch all the directories inside a directory, and return the records
+    of their files.  Each directory is watched before being read, so no
+    change is missed between the scan and the watch.
+
+    @param inotify: The Inotify instance.
+
+    @param path: An absolute path of a directory.
+
+    @param scan_filter: The ScanFilter of the files kept, None to keep
+    all the files.  The directories pruned are not watched.
+
+    @param stats: The ScanStats counting the directories and files
+    scanned, None to not count them.
+
+    @return: A list of FileRecord with absolute paths.
+    """
+    records = []
+    directories = [path]
+    while directories:
+        directory = directories.pop()
+        try:
+            inotify.add_watch(directory)
+        except OSError:
+            continue
+        if stats is not None:
+            stats.start('scan')
+        files, sub_directories = scan_directory(directory, scan_filter,
+                                                stats)
+        if stats is not None:
+            stats.scanned(files)
+        records += files
+        directories += reversed(sub_directories)
+
+    return records
+
+
+def is_kept(path, name, record, scan_filter):
+    """
+    Return True if a file changed in the tree is kept in the index.
+
+    @param path: The path of the file.
+
+    @param name: The name of the file.
+
+    @param record: The FileRecord of the file, None if it can't be
+    accessed.
+
+    @param scan_filter: The ScanFilter of the files kept, None to keep
+    all the files.
+
+    @return: A Boolean value.
+    """
+    if record is None or record.size == 0:
+        return False
+
+    return scan_filter is None or \
+        (is_name_kept(name, path, scan_filter) and
+         is_size_kept(record.size, scan_filter))
+
+
+def apply_events(index, inotify, events, scan_filter=None, stats=None):
+    """
+    Update the index with the events of the kernel.
+
+    @param index: The DuplicateIndex of the tree.
+
+    @param inotify: The Inotify instance watching the tree.
+
+    @param events: The list of events returned by Inotify.read_events.
+
+    @param scan_filter: The ScanFilter of the files kept, None to keep
+    all the files.
+
+    @param stats: The ScanStats counting the directories and files
+    scanned inside the directories created, None to not count them.
+
+    @return: The set of sizes whose groups may have changed.
+    """
+    sizes = set()
+    for directory, mask, name in events:
+        if directory is None or not name:
+            continue
+        path = join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                sizes |= index.remove_directory(path)
+            elif mask & (IN_CREATE | IN_MOVED_TO) and \
+                    (scan_filter is None or
+                     not is_pruned(name, path, scan_filter)):
+                for record in watch_tree(inotify, path, scan_filter,
+                                         stats):
+                    sizes |= index.add(record)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            sizes |= index.remove(path)
+        else:
+            record = get_file_record(path)
+            if not is_kept(path, name, record, scan_filter):
+                sizes |= index.remove(path)
+            else:
+                sizes |= index.add(record)
+
+    return sizes
+
+
+def print_changes(changes):
+    """
+    Print each changed size and its groups of duplicates as a JSON line.
+
+    @param changes: A list of tuples of a size and its groups of
+    duplicates.
+    """
+    for size, groups in changes:
+        print(dumps({'size': size,
+                     'groups': [[record.path for record in group]
+                                for group in groups]}), flush=True)
+
+
+def watch_duplicate_files(path, find_duplicates, emit=print_changes,
+                          timeout=None, scan_filter=None, stats=None):
+    """
+    Scan a directory once, then keep its groups of duplicates up to date
+    from the events of the kernel, emitting the groups of each size whose
+    duplicates have changed.
+
+    @param path: A path of a directory.
+
+    @param find_duplicates: The function generating the groups of
+    duplicates of a list of FileRecord.
+
+    @param emit: The function called with the list of tuples of a size
+    and its groups of duplicates, first for all the sizes with duplicates
+    then for the sizes whose duplicates have changed.
+
+    @param timeout: The maximum number of seconds to wait for an event
+    before stopping, None to watch until the directory is moved or
+    removed, its files are then emitted as removed.
+
+    @param scan_filter: The ScanFilter of the files kept, None to keep
+    all the files.
+
+    @param stats: The ScanStats counting the directories and files
+    scanned by the first scan, the directories created and the full scans
+    after an overflow, None to not count them.
+    """
+    path = abspath(path)
+    inotify = Inotify()
+    try:
+        index = DuplicateIndex(find_duplicates,
+                               watch_tree(inotify, path, scan_filter, stats))
+        emit(sorted(index.groups.items()))
+        while True:
+            events = inotify.read_events(timeout)
+            if not events and timeout is not None:
+                break
+            # The paths of the tree are gone with the directory
+            if any(directory == path and mask & (IN_DELETE_SELF |
+                                                 IN_MOVE_SELF)
+                   for directory, mask, _ in events):
+                changes = index.refresh(index.reset([]))
+                if changes:
+                    emit(changes)
+                break
+            # The kernel has dropped events, scan the whole tree again
+            if any(mask & IN_Q_OVERFLOW for _, mask, _ in events):
+                sizes = index.reset(watch_tree(inotify, path, scan_filter,
+                                               stats))
+            else:
+                sizes = apply_events(index, inotify, events, scan_filter,
+                                     stats)
+            changes = index.refresh(sizes)
+            if changes:
+                emit(changes)
+    finally:
+        inotify.close()